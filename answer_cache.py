@@ -0,0 +1,143 @@
+import collections
+import math
+import re
+import threading
+import time
+
+STOPWORDS = frozenset(
+    "a an the is are am be do does did can could would will you your we our i me my to of for in on at and or "
+    "what whats which how when where who there here any some with about please hi hello hey".split())
+# A question containing one of these leans on the conversation so far ("how
+# much is it?", "and for pedicures?"), so its answer is not reusable.
+REFERRING_WORDS = frozenset(
+    "it its that this those these they them their he she his her one ones also else other another more "
+    "instead same then and but so".split())
+# A question about the asker ("when is my booking?") is answered from their
+# own details, which must never reach another client. "i'm" normalizes to
+# "i m".
+FIRST_PERSON_WORDS = frozenset("i me my mine myself im".split())
+
+
+def normalize_question(text):
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def standalone(question):
+    words = question.split()
+    return len(words) >= 2 and REFERRING_WORDS.isdisjoint(words) and FIRST_PERSON_WORDS.isdisjoint(words)
+
+
+def about_asker(text):
+    return not FIRST_PERSON_WORDS.isdisjoint(normalize_question(text).split())
+
+
+def content_terms(question):
+    terms = collections.Counter()
+    for word in question.split():
+        if word not in STOPWORDS:
+            terms[word[:-1] if len(word) > 3 and word.endswith("s") else word] += 1
+    return terms
+
+
+# Answers to self-contained informational questions (prices, services,
+# opening hours), so a question asked again is answered without a new
+# Assistant run. The cache is shared by every conversation: callers only
+# store answers written for a client whose details the Assistant has not
+# seen. Lookups match the normalized question exactly and, when a
+# similarity threshold is set, fall back to the closest cached question by
+# cosine similarity of its content words. Entries expire after ttl seconds
+# and the least recently used go first once max_entries is reached. Each
+# worker process keeps its own cache.
+class AnswerCache:
+    def __init__(self, ttl=21600, max_entries=1000, similarity=0.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._postings = collections.defaultdict(set)
+        self._stats = collections.Counter()
+
+    def get(self, text):
+        question = normalize_question(text)
+        if not standalone(question):
+            self._count("uncacheable")
+            return None
+        with self._lock:
+            entry = self._live(question)
+            if entry is not None:
+                self._entries.move_to_end(question)
+                self._stats["hits"] += 1
+                return entry[1]
+            if self.similarity:
+                match = self._closest(content_terms(question))
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self._stats["similar_hits"] += 1
+                    return self._entries[match][1]
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, text, answer):
+        question = normalize_question(text)
+        if not standalone(question):
+            return
+        terms = content_terms(question)
+        with self._lock:
+            self._remove(question)
+            self._entries[question] = (time.monotonic() + self.ttl, answer, terms)
+            for term in terms:
+                self._postings[term].add(question)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats.get("hits", 0) + stats.get("similar_hits", 0) + stats.get("misses", 0)
+        stats["hit_rate"] = (stats.get("hits", 0) + stats.get("similar_hits", 0)) / lookups if lookups else 0.0
+        return stats
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _live(self, question):
+        entry = self._entries.get(question)
+        if entry is not None and entry[0] <= time.monotonic():
+            self._remove(question)
+            self._stats["expired"] += 1
+            return None
+        return entry
+
+    def _closest(self, terms):
+        # Only questions sharing a content word with this one are scored.
+        candidates = set()
+        for term in terms:
+            candidates |= self._postings.get(term, set())
+        norm = math.sqrt(sum(count * count for count in terms.values()))
+        best, best_score = None, self.similarity
+        for question in candidates:
+            entry = self._live(question)
+            if entry is None:
+                continue
+            other = entry[2]
+            dot = sum(count * other[term] for term, count in terms.items() if term in other)
+            score = dot / (norm * math.sqrt(sum(count * count for count in other.values())))
+            if score >= best_score:
+                best, best_score = question, score
+        return best
+
+    def _remove(self, question):
+        entry = self._entries.pop(question, None)
+        if entry is None:
+            return
+        for term in entry[2]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.discard(question)
+                if not postings:
+                    del self._postings[term]
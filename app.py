@@ -1,96 +1,160 @@
-from flask import Flask, request, render_template, jsonify
-from openai import OpenAI
-import spacy
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import click
+from flask import Blueprint, Flask, Response, request, render_template, jsonify
 import os
+import hmac
+import json
+import logging
+import queue
 import datetime
 import pytz
 from dateutil import parser
 from dateutil.relativedelta import relativedelta
 import re
+import threading
+import uuid
+from collections import Counter
 
-app = Flask(__name__)
-nlp = spacy.load("en_core_web_sm")
+from answer_cache import AnswerCache, about_asker
+from assistant import AssistantError, finish_run, start_run, stream_text
+from calendar_client import CalendarClientManager
+from conversation import (ASK_DATE_TIME, ASK_NAME, ASK_PHONE, ASK_SERVICE, BOOKING, CONFIRM, IDLE, NEW_TIME, SUGGESTED,
+                          Session)
+from scheduling import DEFAULT_DURATION, SERVICES, ResourceScheduler, find_service, load_resource_pools, service_duration
+from reservations import create_reservation_book
+from sessions import create_session_store
+from temporal import cache_info as date_cache_info, parse_when
+import tracing
+from text_pipeline import MessageParser, load_pipeline
+
+logger = logging.getLogger(__name__)
+chat_routes = Blueprint("chat", __name__, cli_group=None)
+# Heavy resources (the spaCy model, the OpenAI and Calendar clients) are built
+# on first use so importing this module stays cheap; warm_up() builds the ones
+# worth sharing before gunicorn forks its workers.
+message_parser = MessageParser(load_pipeline)
 ID = ""
-client = OpenAI(api_key="")
-conversation_state = {}
+openai_client = None
+openai_client_lock = threading.Lock()
+ASSISTANT_TIMEOUT = float(os.environ.get('ASSISTANT_TIMEOUT', '25'))
+HISTORY_WINDOW = int(os.environ.get('HISTORY_WINDOW', '20'))
+BOOKING_KEYWORDS = {"book", "schedule", "appointment"}
+ASSISTANT_FALLBACK_REPLY = "I'm sorry, I'm having trouble answering right now. Please try again in a moment."
+assistant_calls = Counter()
+assistant_calls_lock = threading.Lock()
+# While a reply is being streamed, the Assistant's text deltas are also put
+# on reply_stream.queue for the thread serving /chat/stream.
+reply_stream = threading.local()
 
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 UAE_TZ = pytz.timezone('Asia/Dubai')
 SERVICE_ACCOUNT_FILE = 'service_account_file.json'
 CALENDAR_ID = 'd378bb6715e5eae240ea302dab2c8e2ef92f7f9a6d7e8555d5b885d13b095721@group.calendar.google.com'
 
+# For offline runs and load tests: CALENDAR_ROOT_URL points the Calendar client
+# at a fake_calendar.FakeCalendarServer, and FAKE_ASSISTANT_LATENCY swaps the
+# OpenAI client for a fake_assistant.FakeAssistantClient.
+CALENDAR_ROOT_URL = os.environ.get('CALENDAR_ROOT_URL')
+FAKE_ASSISTANT_LATENCY = os.environ.get('FAKE_ASSISTANT_LATENCY')
+
+def anonymous_credentials():
+    from google.auth.credentials import AnonymousCredentials
+
+    return AnonymousCredentials()
+
+calendar_clients = CalendarClientManager(SERVICE_ACCOUNT_FILE, SCOPES,
+                                         pool_size=int(os.environ.get('CALENDAR_POOL_SIZE', '10')),
+                                         credentials_factory=anonymous_credentials if CALENDAR_ROOT_URL else None,
+                                         root_url=CALENDAR_ROOT_URL)
+calendar_service = None
+
 def get_calendar_service():
-    credentials = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    return build('calendar', 'v3', credentials=credentials)
+    if calendar_service is not None:
+        return calendar_service
+    return calendar_clients.service()
+
+def get_openai_client():
+    global openai_client
+    if openai_client is None:
+        with openai_client_lock:
+            if openai_client is None:
+                if FAKE_ASSISTANT_LATENCY is not None:
+                    from fake_assistant import FakeAssistantClient
+
+                    openai_client = FakeAssistantClient(latency=float(FAKE_ASSISTANT_LATENCY))
+                else:
+                    from openai import OpenAI
 
-def is_time_slot_available(start_time, end_time):
-    if start_time.hour < 9 or end_time.hour > 18 or (end_time.hour == 18 and end_time.minute > 0):
+                    openai_client = OpenAI(api_key="")
+    return openai_client
+
+def use_backends(assistant=None, calendar=None):
+    # Replaces the OpenAI client and/or the Calendar service for the whole
+    # process, e.g. with the fakes from fake_assistant and fake_calendar, and
+    # starts the state built on them over.
+    global openai_client, calendar_service
+    if assistant is None and calendar is None:
+        return
+    if assistant is not None:
+        openai_client = assistant
+    if calendar is not None:
+        calendar_service = calendar
+    build_state()
+
+SLOT_SEARCH_DAYS = int(os.environ.get('SLOT_SEARCH_DAYS', '28'))
+
+def build_state():
+    # What the app learns from its backends: cached answers, conversations,
+    # slot holds and the scheduler's busy indexes with their sync tokens.
+    # Built at import and again by use_backends, so nothing read from the old
+    # backends outlives a swap.
+    global answer_cache, conversation_state, reservations, scheduler
+    answer_cache = AnswerCache(ttl=int(os.environ.get('ANSWER_CACHE_TTL', '21600')),
+                               max_entries=int(os.environ.get('ANSWER_CACHE_SIZE', '1000')),
+                               similarity=float(os.environ.get('ANSWER_CACHE_SIMILARITY', '0')))
+    conversation_state = create_session_store(os.environ.get('SESSION_STORE', 'memory://'),
+                                              ttl=int(os.environ.get('SESSION_TTL', '3600')))
+    reservations = create_reservation_book(os.environ.get('RESERVATIONS_STORE', 'memory://'))
+    scheduler = ResourceScheduler(load_resource_pools(os.environ.get('RESOURCES_FILE'), CALENDAR_ID),
+                                  get_calendar_service, UAE_TZ, reservations,
+                                  max_staleness=int(os.environ.get('CALENDAR_SYNC_INTERVAL', '30')),
+                                  hold_ttl=int(os.environ.get('HOLD_TTL', '600')))
+
+build_state()
+
+def within_business_hours(start_time, end_time):
+    return not (start_time.hour < 9 or end_time.hour > 18 or (end_time.hour == 18 and end_time.minute > 0))
+
+@tracing.timed("hold")
+def hold_time_slot(start_time, end_time, service_name, owner):
+    # Offering a slot holds it for this conversation until HOLD_TTL runs out.
+    if not within_business_hours(start_time, end_time):
         return False
 
-    service = get_calendar_service()
-    events_result = service.events().list(
-        calendarId=CALENDAR_ID,
-        timeMin=start_time.isoformat(),
-        timeMax=end_time.isoformat(),
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
-    events = events_result.get('items', [])
-    
-    return len(events) == 0
+    return scheduler.hold(find_service(service_name), start_time, end_time, owner) is not None
 
-def find_next_available_slot(start_time, end_time, appointment_duration):
-    service = get_calendar_service()
-    max_attempts = 10
-    
-    for _ in range(max_attempts):
-        events_result = service.events().list(
-            calendarId=CALENDAR_ID,
-            timeMin=start_time.isoformat(),
-            timeMax=(start_time + datetime.timedelta(days=7)).isoformat(),
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-        events = events_result.get('items', [])
-        
-        while start_time.hour < 9:
-            start_time = start_time.replace(hour=9, minute=0, second=0, microsecond=0)
-        
-        if start_time.hour >= 18:
-            start_time = (start_time + datetime.timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
-        
-        if not events:
-            end_time = start_time + appointment_duration
-            if end_time.hour <= 18 or (end_time.hour == 18 and end_time.minute == 0):
-                return start_time, end_time
-            else:
-                start_time = start_time.replace(hour=9, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
-                continue
-        
-        for event in events:
-            event_start = datetime.datetime.fromisoformat(event['start'].get('dateTime', event['start'].get('date')))
-            event_end = datetime.datetime.fromisoformat(event['end'].get('dateTime', event['end'].get('date')))
-            
-            if start_time + appointment_duration <= event_start:
-                end_time = start_time + appointment_duration
-                if end_time.hour <= 18 or (end_time.hour == 18 and end_time.minute == 0):
-                    return start_time, end_time
-            
-            start_time = max(start_time, event_end)
-            if start_time.hour >= 18:
-                start_time = (start_time + datetime.timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
-    
+def hold_owner(session):
+    if session.hold_id is None:
+        session.hold_id = uuid.uuid4().hex
+    return session.hold_id
+
+@tracing.timed("find_slots")
+def find_available_slots(requested_start, appointment_duration, service_name=None, count=3, owner=None):
+    # Candidates are searched from the start of the requested day, so an
+    # earlier free slot that same day can beat one several days later.
+    day_start = UAE_TZ.localize(datetime.datetime.combine(requested_start.astimezone(UAE_TZ).date(), datetime.time()))
+    horizon_start = max(datetime.datetime.now(UAE_TZ), day_start)
+    horizon_end = horizon_start + datetime.timedelta(days=SLOT_SEARCH_DAYS)
+    return scheduler.find_slots(find_service(service_name), requested_start, appointment_duration,
+                                horizon_start, horizon_end, count=count, owner=owner)
+
+def find_next_available_slot(start_time, end_time, appointment_duration, service_name=None, owner=None):
+    for slot in find_available_slots(start_time, appointment_duration, service_name, owner=owner):
+        if owner is None or hold_time_slot(*slot, service_name, owner):
+            return slot
     return None, None
 
-def create_event(summary, start_time, end_time, description):
-    if not is_time_slot_available(start_time, end_time):
-        return None
-    
-    service = get_calendar_service()
-    event = {
+def appointment_event(summary, start_time, end_time, description):
+    return {
         'summary': summary,
         'description': description,
         'start': {
@@ -102,43 +166,154 @@ def create_event(summary, start_time, end_time, description):
             'timeZone': 'Asia/Dubai',
         },
     }
-    event = service.events().insert(calendarId=CALENDAR_ID, body=event).execute()
-    return event.get('htmlLink')
 
-def format_response(response):
-    if "*" in response:
-        lines = response.split("\n")
-        formatted_lines = []
-        in_list = False
-        for line in lines:
-            if line.startswith("*"):
-                if not in_list:
-                    formatted_lines.append("<ul>")
-                    in_list = True
-                formatted_lines.append(f"<li>{line[1:].strip()}</li>")
-            else:
-                if in_list:
-                    formatted_lines.append("</ul>")
-                    in_list = False
-                formatted_lines.append(line)
-        if in_list:
-            formatted_lines.append("</ul>")
-        response = "<br>".join(formatted_lines)
+@tracing.timed("book")
+def create_event(summary, start_time, end_time, description, service_name=None, owner=None):
+    if not within_business_hours(start_time, end_time):
+        return None
+
+    event = appointment_event(summary, start_time, end_time, description)
+    created = scheduler.book(find_service(service_name), start_time, end_time, owner or uuid.uuid4().hex, event)
+    if not created:
+        return None
+    return created[0].get('htmlLink')
+
+def parse_appointment(record):
+    if not isinstance(record, dict):
+        raise ValueError("appointment must be an object")
+    service = find_service(str(record.get("service") or ""))
+    if service is None:
+        raise ValueError("unknown service")
+    if not record.get("start"):
+        raise ValueError("missing start")
+    start_time = datetime.datetime.fromisoformat(str(record["start"]))
+    start_time = UAE_TZ.localize(start_time) if start_time.tzinfo is None else start_time.astimezone(UAE_TZ)
+    if record.get("end"):
+        end_time = datetime.datetime.fromisoformat(str(record["end"]))
+        end_time = UAE_TZ.localize(end_time) if end_time.tzinfo is None else end_time.astimezone(UAE_TZ)
     else:
-        response = response.replace('\n', '<br>')
-    return response
+        end_time = start_time + service.duration
+    if end_time <= start_time:
+        raise ValueError("end must be after start")
+    if not within_business_hours(start_time, end_time):
+        raise ValueError("outside business hours")
+    summary = f"{service.keyword.capitalize()} Appointment"
+    description = f"Service: {service.keyword}\nName: {record.get('name', '')}\nPhone: {record.get('phone', '')}"
+    return service, start_time, end_time, appointment_event(summary, start_time, end_time, description)
+
+def read_appointment_records(text, json_lines=False):
+    if json_lines:
+        records = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if line.strip():
+                try:
+                    records.append(json.loads(line))
+                except ValueError as e:
+                    raise ValueError(f"line {number}: {e}")
+        return records
+    data = json.loads(text)
+    records = data.get("appointments") if isinstance(data, dict) else data
+    if not isinstance(records, list):
+        raise ValueError("expected a list of appointments")
+    return records
+
+def book_appointments(records):
+    # Staff-side bulk booking: every valid record is checked and booked in
+    # one go by scheduler.book_many; the results keep the input order.
+    results = [None] * len(records)
+    bookings = []
+    positions = []
+    for i, record in enumerate(records):
+        try:
+            bookings.append(parse_appointment(record))
+            positions.append(i)
+        except ValueError as e:
+            results[i] = {"index": i, "status": "invalid", "error": str(e)}
+    for i, (events, error) in zip(positions, scheduler.book_many(bookings, uuid.uuid4().hex)):
+        if error is None:
+            results[i] = {"index": i, "status": "booked", "links": [event.get("htmlLink") for event in events]}
+        elif error == "unavailable":
+            results[i] = {"index": i, "status": "unavailable"}
+        else:
+            results[i] = {"index": i, "status": "failed", "error": error}
+    return {"booked": sum(result["status"] == "booked" for result in results), "results": results}
+
+# Turns "*" lines into <ul>/<li> markup and newlines into <br>, one chunk of
+# text at a time so streamed replies can be formatted as they arrive. Plain
+# lines are passed through as soon as their first character is known; list
+# items are held until their line ends.
+class ResponseFormatter:
+    def __init__(self):
+        self.items = 0
+        self.in_list = False
+        self.line_kind = None
+        self.item = ""
+
+    def feed(self, text):
+        out = []
+        lines = text.split("\n")
+        for i, piece in enumerate(lines):
+            if i > 0:
+                out.append(self._end_line())
+            if not piece:
+                continue
+            if self.line_kind is None:
+                self.line_kind = "item" if piece.startswith("*") else "text"
+                if self.line_kind == "item" and not self.in_list:
+                    out.append(self._next_item() + "<ul>")
+                    self.in_list = True
+                elif self.line_kind == "text":
+                    out.append(self._close_list() + self._next_item())
+            if self.line_kind == "item":
+                self.item += piece
+            else:
+                out.append(piece)
+        return "".join(out)
+
+    def close(self):
+        return self._end_line() + self._close_list()
+
+    def _next_item(self):
+        self.items += 1
+        return "<br>" if self.items > 1 else ""
+
+    def _close_list(self):
+        if not self.in_list:
+            return ""
+        self.in_list = False
+        return self._next_item() + "</ul>"
+
+    def _end_line(self):
+        kind = self.line_kind
+        self.line_kind = None
+        if kind == "item":
+            item, self.item = self.item, ""
+            return self._next_item() + f"<li>{item[1:].strip()}</li>"
+        if kind is None:
+            return self._close_list() + self._next_item()
+        return ""
 
-def parse_date_time(date_time_str):
+@tracing.timed("format_response")
+def format_response(response):
+    formatter = ResponseFormatter()
+    return formatter.feed(response) + formatter.close()
+
+@tracing.timed("parse_date_time")
+def parse_date_time(date_time_str, duration=DEFAULT_DURATION):
     try:
         now = datetime.datetime.now(UAE_TZ)
-        dt = parser.parse(date_time_str, fuzzy=True)
-        if dt.date() == datetime.date(1, 1, 1):
-            if dt.time() < now.time():
-                dt = now.replace(hour=dt.hour, minute=dt.minute, second=0, microsecond=0) + datetime.timedelta(days=1)
-            else:
-                dt = now.replace(hour=dt.hour, minute=dt.minute, second=0, microsecond=0)
-        if 'tomorrow' in date_time_str.lower():
-            dt += datetime.timedelta(days=1)
+        # The rule-based parser covers the usual phrasings; dateutil's fuzzy
+        # parse is only the fallback for whatever it declines.
+        dt = parse_when(date_time_str, now)
+        if dt is None:
+            dt = parser.parse(date_time_str, fuzzy=True)
+            if dt.date() == datetime.date(1, 1, 1):
+                if dt.time() < now.time():
+                    dt = now.replace(hour=dt.hour, minute=dt.minute, second=0, microsecond=0) + datetime.timedelta(days=1)
+                else:
+                    dt = now.replace(hour=dt.hour, minute=dt.minute, second=0, microsecond=0)
+            if 'tomorrow' in date_time_str.lower():
+                dt += datetime.timedelta(days=1)
         if dt.tzinfo is None:
             dt = UAE_TZ.localize(dt)
         else:
@@ -149,43 +324,27 @@ def parse_date_time(date_time_str):
         elif dt.hour >= 18:
             dt = (dt + datetime.timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
         
-        end_time = dt + datetime.timedelta(hours=1)
-        if end_time.hour > 18 or (end_time.hour == 18 and end_time.minute > 0):
-            end_time = dt.replace(hour=18, minute=0, second=0, microsecond=0)
+        end_time = dt + duration
         
         return dt, end_time
     except ValueError:
         return None, None
 
-def extract_date_time_and_type(doc):
+@tracing.timed("extract_date_time")
+def extract_date_time_and_type(message):
+    service = find_service(message)
+    appointment_type = service.keyword if service else None
+    # When the rule-based parser understands the message, parse_date_time
+    # gets the message itself and spaCy never has to run.
+    if parse_when(message, datetime.datetime.now(UAE_TZ)):
+        return message, appointment_type
+
+    doc = message_parser.parse(message)
     date_time_str = " ".join([ent.text for ent in doc.ents if ent.label_ in ["DATE", "TIME"]])
     if not any(ent.label_ == "DATE" for ent in doc.ents) and "tomorrow" in [token.text.lower() for token in doc]:
         date_time_str = "tomorrow " + date_time_str
-    
-    appointment_types = [
-        "classic manicure", "deluxe pedicure", "facial treatment", "haircut and styling",
-        "hair coloring", "waxing", "eyelash extensions", "microdermabrasion",
-        "chemical peel", "massage therapy", "bridal makeup", "hair spa treatment"
-    ]
-    
-    appointment_type = None
-    for type in appointment_types:
-        if type.lower() in doc.text.lower():
-            appointment_type = type
-            break
     return date_time_str, appointment_type
 
-def extract_name_and_phone(message):
-    doc = nlp(message)
-    name = None
-    phone = None
-    for ent in doc.ents:
-        if ent.label_ == "PERSON":
-            name = ent.text
-        elif ent.label_ == "CARDINAL" and len(ent.text) >= 7:
-            phone = ent.text
-    return name, phone
-
 def validate_name(name):
     if name and len(name.split()) >= 2:
         return True
@@ -195,277 +354,426 @@ def validate_phone(phone):
     phone_regex = re.compile(r'^\+?1?\d{9,15}$')
     return phone_regex.match(phone) is not None 
 
-def process_message(message, user_state):
-    user_state["last_message"] = message
-    user_state["messages"].append({"role": "user", "content": message})
-
-    if "booking_state" in user_state and user_state["booking_state"] in ["awaiting_new_time", "prompt_new_time"]:
-        date_time_str, new_appointment_type = extract_date_time_and_type(nlp(message.lower()))
-        if date_time_str:
-            start_time, end_time = parse_date_time(date_time_str)
-            if start_time and end_time:
-                if is_time_slot_available(start_time, end_time):
-                    appointment_type = user_state.get("pending_appointment", {}).get("type", "appointment")
-                    if "pending_appointment" not in user_state:
-                        user_state["pending_appointment"] = {}
-                    user_state["pending_appointment"].update({
-                        "type": appointment_type,
-                        "start_time": start_time.isoformat(),
-                        "end_time": end_time.isoformat(),
-                    })
-                    del user_state["booking_state"]
-                    reply = f"Great! I've found an available slot for your appointment on {start_time.strftime('%Y-%m-%d %I:%M %p')} UAE time. "
-                    if "service" not in user_state["pending_appointment"]:
-                        user_state["gathering_info"] = "service"
-                        reply += "What service would you like to book? (e.g., Classic Manicure, Deluxe Pedicure, Facial Treatment, etc.)"
-                    elif "name" not in user_state["pending_appointment"]:
-                        user_state["gathering_info"] = "name"
-                        reply += "Could you please provide your full name?"
-                    elif "phone" not in user_state["pending_appointment"]:
-                        user_state["gathering_info"] = "phone"
-                        reply += "Could you please provide your phone number?"
-                    else:
-                        reply += "Is this information correct? Please respond with 'Yes' to confirm or 'No' to cancel."
-                else:
-                    reply = f"I'm sorry, but the time slot you requested ({start_time.strftime('%Y-%m-%d %I:%M %p')}) is either outside our business hours (9 AM to 5 PM) or already taken. Would you like to try another time?"
-                    user_state["booking_state"] = "awaiting_new_time"
-            else:
-                reply = "I'm sorry, I couldn't understand the date and time. Could you please specify it more clearly? (e.g., 'next Monday at 2 PM')"
-        else:
-            reply = "I didn't catch a date and time in your message. Could you please specify when you'd like to schedule the appointment? Remember, our business hours are from 9 AM to 5 PM."
-        user_state["messages"].append({"role": "assistant", "content": reply})
-        return reply, user_state
-
-    chat = client.beta.threads.create(messages=user_state["messages"])
-    run = client.beta.threads.runs.create(thread_id=chat.id, assistant_id=ID)
-    while run.status != "completed":
-        run = client.beta.threads.runs.retrieve(thread_id=chat.id, run_id=run.id)
-    message_response = client.beta.threads.messages.list(thread_id=chat.id)
-    messages = message_response.data
-    latest_message = messages[0]
-    reply = latest_message.content[0].text.value
-
-    if "gathering_info" in user_state:
-        if user_state["gathering_info"] == "service":
-            if "pending_appointment" not in user_state:
-                user_state["pending_appointment"] = {}
-            user_state["pending_appointment"]["service"] = message
-            user_state["gathering_info"] = "date_time"
-            reply = f"Thank you. You've selected {message} as your service. Now, could you please provide your preferred date and time for the appointment? (e.g., 'next Monday at 2 PM')"
-        elif user_state["gathering_info"] == "date_time":
-            date_time_str, _ = extract_date_time_and_type(nlp(message.lower()))
-            if date_time_str:
-                start_time, end_time = parse_date_time(date_time_str)
-                if start_time and end_time:
-                    if is_time_slot_available(start_time, end_time):
-                        user_state["pending_appointment"].update({
-                            "start_time": start_time.isoformat(),
-                            "end_time": end_time.isoformat()
-                        })
-                        user_state["gathering_info"] = "name"
-                        reply = f"Great! I've found an available slot for your {user_state['pending_appointment']['service']} appointment on {start_time.strftime('%Y-%m-%d %I:%M %p')} UAE time. Could you please provide your full name?"
-                    else:
-                        next_start, next_end = find_next_available_slot(start_time, end_time, datetime.timedelta(hours=1))
-                        if next_start and next_end:
-                            user_state["booking_state"] = "suggest_new_time"
-                            user_state["suggested_time"] = {
-                                "start": next_start.isoformat(),
-                                "end": next_end.isoformat()
-                            }
-                            reply = f"I'm sorry, but the time slot you requested ({start_time.strftime('%Y-%m-%d %I:%M %p')}) is not available. The next available slot is on {next_start.strftime('%Y-%m-%d %I:%M %p')}. Would you like to book this slot instead? Please respond with 'Yes' to confirm or 'No' to choose a different time."
-                        else:
-                            user_state["booking_state"] = "awaiting_new_time"
-                            reply = f"I'm sorry, but the time slot you requested ({start_time.strftime('%Y-%m-%d %I:%M %p')}) is not available, and I couldn't find an available slot in the near future. Would you like to choose a different time?"
-                else:
-                    reply = "I'm sorry, I couldn't understand the date and time. Could you please specify it more clearly? (e.g., 'next Monday at 2 PM')"
-            else:
-                reply = "I didn't catch a date and time in your message. Could you please specify when you'd like to schedule the appointment? Remember, our business hours are from 9 AM to 5 PM."
-        elif user_state["gathering_info"] == "name":
-            if "pending_appointment" not in user_state:
-                user_state["pending_appointment"] = {}
-            user_state["pending_appointment"]["name"] = message
-            user_state["gathering_info"] = "phone"
-            reply = "Thank you. Now, could you please provide your phone number?"
-        elif user_state["gathering_info"] == "phone":
-            if "pending_appointment" not in user_state:
-                user_state["pending_appointment"] = {}
-            user_state["pending_appointment"]["phone"] = message
-            del user_state["gathering_info"]
-            appointment = user_state["pending_appointment"]
-            
-            start_time_str = appointment.get('start_time')
-            if start_time_str:
-                try:
-                    start_time = datetime.datetime.fromisoformat(start_time_str)
-                    start_time_display = start_time.strftime('%Y-%m-%d %I:%M %p')
-                except ValueError:
-                    start_time_display = "Invalid date/time"
-            else:
-                start_time_display = "Not specified"
-
-            reply = f"Great! I have the following details for your appointment:\n\n"
-            reply += f"Service: {appointment.get('service', 'Not specified')}\n"
-            reply += f"Date and Time: {start_time_display} UAE time\n"
-            reply += f"Name: {appointment.get('name', 'Not specified')}\n"
-            reply += f"Phone: {appointment.get('phone', 'Not specified')}\n\n"
-            reply += "Is this information correct? Please respond with 'Yes' to confirm or 'No' to cancel."
-    elif any(token.text.lower() in ["book", "schedule", "appointment"] for token in nlp(message.lower())) or \
-         ("booking_state" in user_state and user_state["booking_state"] == "prompt_new_time"):
-        date_time_str, new_appointment_type = extract_date_time_and_type(nlp(message.lower()))
-        
+@tracing.timed("assistant")
+def ask_assistant(session):
+    import openai
 
+    deltas = getattr(reply_stream, "queue", None)
+    client = get_openai_client()
+    messages = [{"role": role, "content": content} for role, content in session.messages]
+    thread_id, run = start_run(client, ID, messages, thread_id=session.thread_id,
+                               history_window=HISTORY_WINDOW, stream=deltas is not None,
+                               timeout=ASSISTANT_TIMEOUT if deltas is not None else None)
+    session.thread_id = thread_id
+    session.messages = []
+    if deltas is None:
+        return finish_run(client, thread_id, run, timeout=ASSISTANT_TIMEOUT)
+    parts = []
+    try:
+        for delta in stream_text(client, thread_id, run, timeout=ASSISTANT_TIMEOUT):
+            parts.append(delta)
+            deltas.put(delta)
+    except (AssistantError, openai.OpenAIError) as e:
+        if not parts:
+            raise
+        # The user has already seen the beginning, so keep it.
+        logger.warning("assistant stream broke off: %s", e)
+        parts.append("\n\n" + ASSISTANT_FALLBACK_REPLY)
+    return "".join(parts)
 
-        services = [
-            "Classic Manicure",
-            "Deluxe Pedicure",
-            "Facial Treatment",
-            "Haircut and Styling",
-            "Hair Coloring",
-            "Waxing (Full Body)",
-            "Eyelash Extensions",
-            "Microdermabrasion",
-            "Chemical Peel",
-            "Massage Therapy (1 hour)",
-            "Bridal Makeup",
-            "Hair Spa Treatment"
-        ]
-
-        numbered_services = [f"{i+1}. {service}" for i, service in enumerate(services)]
-        services_list = "\n".join(numbered_services)
-
-        if not date_time_str and not new_appointment_type:
-            user_state["gathering_info"] = "service"
-            reply = f"I understand you want to book an appointment. What service would you like to book? We offer:\n\n{services_list}"
+def generate_reply(session):
+    import openai
 
+    try:
+        return ask_assistant(session)
+    except (AssistantError, openai.OpenAIError) as e:
+        logger.warning("assistant unavailable: %s", e)
+        return ASSISTANT_FALLBACK_REPLY
+
+def count_assistant_call(kind):
+    with assistant_calls_lock:
+        assistant_calls[kind] += 1
+        logger.debug("assistant calls made: %d, skipped: %d, answered from cache: %d",
+                     assistant_calls["called"], assistant_calls["skipped"], assistant_calls["cached"])
+
+@tracing.timed("classify")
+def classify_turn(message, session):
+    # Each state owns the turns that arrive while it is current. Only a
+    # request to book takes the turn away from the states in INTERRUPTIBLE;
+    # a question the bot is waiting on is answered first.
+    if session.state in INTERRUPTIBLE and not BOOKING_KEYWORDS.isdisjoint(re.findall(r"\w+", message.lower())):
+        return BOOKING
+    return session.state
+
+def remember_reply(session, reply):
+    # Replies the thread has not seen yet wait here until the next run.
+    session.messages.append(("assistant", reply))
+    del session.messages[:-HISTORY_WINDOW]
+
+def process_message(message, session):
+    reply = handle_message(message, session)
+    return format_response(reply), session
+
+def stream_message(message, session, save):
+    # handle_message runs on a helper thread so the Assistant's text can be
+    # formatted and sent while the run is still generating it. save() is
+    # called on that thread as soon as the turn is handled, so the session is
+    # stored even if the client goes away before the last chunk.
+    deltas = queue.Queue()
+    outcome = {}
+    trace = tracing.current()
+
+    def run():
+        reply_stream.queue = deltas
+        try:
+            with tracing.attach(trace):
+                outcome["reply"] = handle_message(message, session)
+                save()
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            reply_stream.queue = None
+            deltas.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+    formatter = ResponseFormatter()
+    streamed = 0
+    for delta in iter(deltas.get, None):
+        streamed += len(delta)
+        yield formatter.feed(delta)
+    if "error" in outcome:
+        raise outcome["error"]
+    # Whatever follows the streamed text (or the whole reply, for turns that
+    # never reach the Assistant) goes out in one last chunk.
+    yield formatter.feed(outcome["reply"][streamed:]) + formatter.close()
+
+def display_time(moment):
+    return moment.strftime('%Y-%m-%d %I:%M %p')
+
+def ask_next_question(session, reply):
+    # After a slot is settled: ask for the first missing detail, or for
+    # confirmation once everything is known.
+    session.state = session.next_question()
+    if session.state == ASK_SERVICE:
+        reply += "What service would you like to book? (e.g., Classic Manicure, Deluxe Pedicure, Facial Treatment, etc.)"
+    elif session.state == ASK_NAME:
+        reply += "Could you please provide your full name?"
+    elif session.state == ASK_PHONE:
+        reply += "Could you please provide your phone number?"
+    else:
+        reply += "Is this information correct? Please respond with 'Yes' to confirm or 'No' to cancel."
+    return reply
+
+def settle_slot(session, start_time, end_time):
+    session.start, session.end = start_time, end_time
+    session.suggested_start = session.suggested_end = None
+
+def offer_next_slot(session, start_time, end_time):
+    # The requested slot is taken: suggest the closest free one, held for
+    # this session while the client decides, or wait for another time.
+    next_start, next_end = find_next_available_slot(start_time, end_time, end_time - start_time, session.service,
+                                                    hold_owner(session))
+    if next_start and next_end:
+        session.state = SUGGESTED
+        session.suggested_start, session.suggested_end = next_start, next_end
+        return next_start
+    session.state = NEW_TIME
+    return None
+
+def answer_question(message, session):
+    # Only talk about the client makes the thread personal; a greeting or a
+    # follow-up is just not cached itself.
+    if about_asker(message):
+        session.personal = True
+    reply = answer_cache.get(message)
+    source = "cached"
+    if reply is None:
+        reply = generate_reply(session)
+        source = "called"
+        # Once the thread holds the client's details, the Assistant may use
+        # them in any answer, so those answers stay with this conversation.
+        if not session.personal and not reply.endswith(ASSISTANT_FALLBACK_REPLY):
+            answer_cache.put(message, reply)
+    return reply + "\n\nIs there anything specific you'd like to know about our services or booking an appointment?", source
+
+def take_service(message, session):
+    session.service = message
+    session.state = ASK_DATE_TIME
+    return f"Thank you. You've selected {message} as your service. Now, could you please provide your preferred date and time for the appointment? (e.g., 'next Monday at 2 PM')", "skipped"
+
+def take_date_time(message, session):
+    date_time_str, _ = extract_date_time_and_type(message)
+    if not date_time_str:
+        return "I didn't catch a date and time in your message. Could you please specify when you'd like to schedule the appointment? Remember, our business hours are from 9 AM to 5 PM.", "skipped"
+    start_time, end_time = parse_date_time(date_time_str, service_duration(session.service))
+    if not (start_time and end_time):
+        return "I'm sorry, I couldn't understand the date and time. Could you please specify it more clearly? (e.g., 'next Monday at 2 PM')", "skipped"
+    if hold_time_slot(start_time, end_time, session.service, hold_owner(session)):
+        settle_slot(session, start_time, end_time)
+        session.state = ASK_NAME
+        return f"Great! I've found an available slot for your {session.service} appointment on {display_time(start_time)} UAE time. Could you please provide your full name?", "skipped"
+    next_start = offer_next_slot(session, start_time, end_time)
+    if next_start:
+        return f"I'm sorry, but the time slot you requested ({display_time(start_time)}) is not available. The closest available slot is on {display_time(next_start)}. Would you like to book this slot instead? Please respond with 'Yes' to confirm or 'No' to choose a different time.", "skipped"
+    return f"I'm sorry, but the time slot you requested ({display_time(start_time)}) is not available, and I couldn't find an available slot in the near future. Would you like to choose a different time?", "skipped"
+
+def take_name(message, session):
+    session.name = message
+    session.state = ASK_PHONE
+    return "Thank you. Now, could you please provide your phone number?", "skipped"
+
+def take_phone(message, session):
+    session.phone = message
+    session.state = CONFIRM
+    reply = f"Great! I have the following details for your appointment:\n\n"
+    reply += f"Service: {session.service or 'Not specified'}\n"
+    reply += f"Date and Time: {display_time(session.start) if session.start else 'Not specified'} UAE time\n"
+    reply += f"Name: {session.name or 'Not specified'}\n"
+    reply += f"Phone: {session.phone}\n\n"
+    reply += "Is this information correct? Please respond with 'Yes' to confirm or 'No' to cancel."
+    return reply, "skipped"
+
+def answer_suggestion(message, session):
+    answer = message.lower()
+    if answer == "yes":
+        settle_slot(session, session.suggested_start, session.suggested_end)
+        return ask_next_question(session, f"Great! I've found an available slot for your appointment on {display_time(session.start)} UAE time. "), "skipped"
+    if answer == "no":
+        scheduler.release(hold_owner(session))
+        session.suggested_start = session.suggested_end = None
+        session.state = NEW_TIME
+        return "I understand. Would you like to choose a different time for your appointment?", "skipped"
+    return "I'm sorry, I didn't understand your response. Please respond with 'Yes' to confirm the suggested time slot, or 'No' to choose a different time.", "skipped"
+
+def take_new_time(message, session):
+    date_time_str, _ = extract_date_time_and_type(message)
+    if not date_time_str:
+        return "I didn't catch a date and time in your message. Could you please specify when you'd like to schedule the appointment? Remember, our business hours are from 9 AM to 5 PM.", "skipped"
+    start_time, end_time = parse_date_time(date_time_str, service_duration(session.service))
+    if not (start_time and end_time):
+        return "I'm sorry, I couldn't understand the date and time. Could you please specify it more clearly? (e.g., 'next Monday at 2 PM')", "skipped"
+    if not hold_time_slot(start_time, end_time, session.service, hold_owner(session)):
+        return f"I'm sorry, but the time slot you requested ({display_time(start_time)}) is either outside our business hours (9 AM to 5 PM) or already taken. Would you like to try another time?", "skipped"
+    settle_slot(session, start_time, end_time)
+    return ask_next_question(session, f"Great! I've found an available slot for your appointment on {display_time(start_time)} UAE time. "), "skipped"
+
+def confirm_booking(message, session):
+    answer = message.lower()
+    if answer == "yes":
+        event_summary = f"{session.service.capitalize()} Appointment"
+        description = f"Service: {session.service}\nName: {session.name}\nPhone: {session.phone}"
+        event_link = create_event(event_summary, session.start, session.end, description, session.service,
+                                  hold_owner(session))
+        if event_link:
+            reply = f"Great! I've booked your {session.service} appointment for {display_time(session.start)} UAE time. You can view it here: {event_link}"
+            reply += "\n\nIs there anything else I can help you with?"
+            session.clear_appointment()
+            session.state = IDLE
         else:
-            if "pending_appointment" in user_state and "service" in user_state["pending_appointment"]:
-                appointment_type = user_state["pending_appointment"]["service"]
-            else:
-                appointment_type = new_appointment_type
-
-            if date_time_str:
-                start_time, end_time = parse_date_time(date_time_str)
-                if start_time and end_time:
-                    if appointment_type:
-                        appointment_duration = end_time - start_time
-                        if is_time_slot_available(start_time, end_time):
-                            name = user_state.get("pending_appointment", {}).get("name")
-                            phone = user_state.get("pending_appointment", {}).get("phone")
-                            user_state["pending_appointment"] = {
-                                "service": appointment_type,
-                                "start_time": start_time.isoformat(),
-                                "end_time": end_time.isoformat(),
-                                "name": name,
-                                "phone": phone
-                            }
-                            if "booking_state" in user_state:
-                                del user_state["booking_state"]
-                            if not appointment_type:
-                                user_state["gathering_info"] = "service"
-                                reply = f"la I understand you want to book an appointment for {start_time.strftime('%Y-%m-%d %I:%M %p')} UAE time. What service would you like to book? (e.g., Classic Manicure, Deluxe Pedicure, Facial Treatment, etc.)"
-                            elif not name:
-                                user_state["gathering_info"] = "name"
-                                reply = f"I understand you want to book a {appointment_type} appointment for {start_time.strftime('%Y-%m-%d %I:%M %p')} UAE time. Could you please provide your full name?"
-                            elif not phone:
-                                user_state["gathering_info"] = "phone"
-                                reply = f"Thank you, {name}. Could you please provide your phone number?"
-                            else:
-                                reply = f"I understand you want to book a {appointment_type} appointment for {start_time.strftime('%Y-%m-%d %I:%M %p')} UAE time.\n\n"
-                                reply += f"Name: {name}\nPhone: {phone}\n\n"
-                                reply += "Is this information correct? Please respond with 'Yes' to confirm or 'No' to cancel."
-                        else:
-                            next_start, next_end = find_next_available_slot(start_time, end_time, appointment_duration)
-                            if next_start and next_end:
-                                user_state["booking_state"] = "suggest_new_time"
-                                user_state["suggested_time"] = {
-                                    "start": next_start.isoformat(),
-                                    "end": next_end.isoformat()
-                                }
-                                reply = f"Unfortunately, the time slot you requested ({start_time.strftime('%Y-%m-%d %I:%M %p')}) is either outside our business hours (9 AM to 5 PM) or already taken. "
-                                reply += f"\n\nThe next available slot is on {next_start.strftime('%Y-%m-%d %I:%M %p')}. "
-                                reply += "\n\nWould you like to book this slot instead? Please respond with 'Yes' to confirm or 'No' to choose a different time."
-                            else:
-                                user_state["booking_state"] = "awaiting_new_time"
-                                reply = f"Unfortunately, the time slot you requested ({start_time.strftime('%Y-%m-%d %I:%M %p')}) is either outside our business hours (9 AM to 5 PM) or already taken. "
-                                reply += "Additionally, I couldn't find an available slot in the near future. Would you like to choose a different time?"
-                    else:
-                        user_state["gathering_info"] = "service"
-                        user_state["pending_appointment"] = {
-                            "start_time": start_time.isoformat(),
-                            "end_time": end_time.isoformat()
-                        }
-                        reply = f"I understand you want to book an appointment, what service would you like to book? (e.g., Classic Manicure, Deluxe Pedicure, Facial Treatment, etc.)"
-                else:
-                    reply += "\n\nI'm sorry, I couldn't understand the date and time for the appointment. Could you please specify it more clearly? Please note that our business hours are from 9 AM to 5 PM."
-            elif appointment_type:
-                user_state["gathering_info"] = "date_time"
-                user_state["pending_appointment"] = {"service": appointment_type}
-                reply = f"I understand you want to book a {appointment_type} appointment. What date and time would you prefer? Please note that our business hours are from 9 AM to 5 PM."
-            else:
-                reply += "\n\nI understand you want to book an appointment, but could you please specify what type of service you'd like? (e.g., Classic Manicure, Deluxe Pedicure, Facial Treatment, etc.)"
-    elif "booking_state" in user_state and user_state["booking_state"] == "suggest_new_time":
-        if message.lower() == "yes":
-            start_time = datetime.datetime.fromisoformat(user_state["suggested_time"]["start"])
-            end_time = datetime.datetime.fromisoformat(user_state["suggested_time"]["end"])
-            appointment_type = user_state.get("pending_appointment", {}).get("service", "appointment")
-            user_state["pending_appointment"] = {
-                "start_time": start_time.isoformat(),
-                "end_time": end_time.isoformat()
-            }
-            del user_state["booking_state"]
-            del user_state["suggested_time"]
-            reply = f"Great! I've found an available slot for your appointment on {start_time.strftime('%Y-%m-%d %I:%M %p')} UAE time. "
-            user_state["gathering_info"] = "service"
-            reply += "\n\nWhat service would you like to book? (e.g., Classic Manicure, Deluxe Pedicure, Facial Treatment, etc.)"
-        elif message.lower() == "no":
-            user_state["booking_state"] = "awaiting_new_time"
-            reply = "I understand. Would you like to choose a different time for your appointment?"
-        else:
-            reply = "I'm sorry, I didn't understand your response. Please respond with 'Yes' to confirm the suggested time slot, or 'No' to choose a different time."
-    elif "pending_appointment" in user_state and "gathering_info" not in user_state:
-        if message.lower() == "yes":
-            appointment = user_state["pending_appointment"]
-            event_summary = f"{appointment['service'].capitalize()} Appointment"
-            description = f"Service: {appointment['service']}\nName: {appointment['name']}\nPhone: {appointment['phone']}"
-            start_time = datetime.datetime.fromisoformat(appointment['start_time'])
-            end_time = datetime.datetime.fromisoformat(appointment['end_time'])
-            event_link = create_event(event_summary, start_time, end_time, description)
-            if event_link:
-                reply = f"Great! I've booked your {appointment['service']} appointment for {start_time.strftime('%Y-%m-%d %I:%M %p')} UAE time. You can view it here: {event_link}"
-                reply += "\n\nIs there anything else I can help you with?"
-                del user_state["pending_appointment"]
-            else:
-                reply = "I apologize, but it seems the time slot is no longer available. Would you like to choose a different time?"
-                user_state["booking_state"] = "awaiting_new_time"
-        elif message.lower() == "no":
-            reply = "I understand. The appointment has not been booked. Is there anything else I can help you with?"
-            del user_state["pending_appointment"]
+            reply = "I apologize, but it seems the time slot is no longer available. Would you like to choose a different time?"
+            session.state = NEW_TIME
+        return reply, "skipped"
+    if answer == "no":
+        scheduler.release(hold_owner(session))
+        session.clear_appointment()
+        session.state = IDLE
+        return "I understand. The appointment has not been booked. Is there anything else I can help you with?", "skipped"
+    return "I'm waiting for your confirmation about the pending appointment. Please respond with 'Yes' to confirm or 'No' to cancel.", "skipped"
+
+def request_booking(message, session):
+    date_time_str, new_appointment_type = extract_date_time_and_type(message)
+    if not date_time_str and not new_appointment_type:
+        services_list = "\n".join(f"{i+1}. {service.name}" for i, service in enumerate(SERVICES))
+        session.state = ASK_SERVICE
+        return f"I understand you want to book an appointment. What service would you like to book? We offer:\n\n{services_list}", "skipped"
+
+    # A service already chosen in this conversation wins over one mentioned now.
+    appointment_type = session.service or new_appointment_type
+    if not date_time_str:
+        session.clear_appointment()
+        session.service = appointment_type
+        session.state = ASK_DATE_TIME
+        return f"I understand you want to book a {appointment_type} appointment. What date and time would you prefer? Please note that our business hours are from 9 AM to 5 PM.", "skipped"
+
+    start_time, end_time = parse_date_time(date_time_str, service_duration(appointment_type))
+    if not (start_time and end_time):
+        reply = generate_reply(session)
+        reply += "\n\nI'm sorry, I couldn't understand the date and time for the appointment. Could you please specify it more clearly? Please note that our business hours are from 9 AM to 5 PM."
+        return reply, "called"
+    if not appointment_type:
+        settle_slot(session, start_time, end_time)
+        session.state = ASK_SERVICE
+        return f"I understand you want to book an appointment, what service would you like to book? (e.g., Classic Manicure, Deluxe Pedicure, Facial Treatment, etc.)", "skipped"
+
+    session.service = appointment_type
+    if not hold_time_slot(start_time, end_time, appointment_type, hold_owner(session)):
+        next_start = offer_next_slot(session, start_time, end_time)
+        reply = f"Unfortunately, the time slot you requested ({display_time(start_time)}) is either outside our business hours (9 AM to 5 PM) or already taken. "
+        if next_start:
+            reply += f"\n\nThe closest available slot is on {display_time(next_start)}. "
+            reply += "\n\nWould you like to book this slot instead? Please respond with 'Yes' to confirm or 'No' to choose a different time."
         else:
-            reply = "I'm waiting for your confirmation about the pending appointment. Please respond with 'Yes' to confirm or 'No' to cancel."
-    else:
-        reply += "\n\nIs there anything specific you'd like to know about our services or booking an appointment?"
+            reply += "Additionally, I couldn't find an available slot in the near future. Would you like to choose a different time?"
+        return reply, "skipped"
+    settle_slot(session, start_time, end_time)
+    session.state = session.next_question()
+    if session.state == ASK_NAME:
+        return f"I understand you want to book a {appointment_type} appointment for {display_time(start_time)} UAE time. Could you please provide your full name?", "skipped"
+    if session.state == ASK_PHONE:
+        return f"Thank you, {session.name}. Could you please provide your phone number?", "skipped"
+    reply = f"I understand you want to book a {appointment_type} appointment for {display_time(start_time)} UAE time.\n\n"
+    reply += f"Name: {session.name}\nPhone: {session.phone}\n\n"
+    reply += "Is this information correct? Please respond with 'Yes' to confirm or 'No' to cancel."
+    return reply, "skipped"
+
+# Turn handlers indexed by conversation state (and BOOKING). Each one returns
+# the reply and whether the Assistant wrote it ("called"), it came from the
+# answer cache ("cached") or the Assistant was not needed ("skipped").
+TURNS = (answer_question, take_service, take_date_time, take_name, take_phone, answer_suggestion, take_new_time,
+         confirm_booking, request_booking)
+INTERRUPTIBLE = frozenset({IDLE, SUGGESTED, CONFIRM})
 
-    reply = format_response(reply)
-    user_state["messages"].append({"role": "assistant", "content": reply})
-    return reply, user_state
+@tracing.timed("handle_message")
+def handle_message(message, session):
+    session.messages.append(("user", message))
+    turn = classify_turn(message, session)
+    if turn != IDLE:
+        # Any booking step tells the thread who the client is or what they want.
+        session.personal = True
+    reply, source = TURNS[turn](message, session)
+    count_assistant_call(source)
+    if source != "called":
+        # A cached answer is queued for the thread like any other reply the
+        # Assistant did not write itself.
+        remember_reply(session, reply)
+    return reply
 
 
-@app.route("/")
+@chat_routes.route("/")
 def index():
     return render_template("index.html")
 
-@app.route("/chat", methods=["POST"])
+@chat_routes.route("/chat", methods=["POST"])
 def chat():
     incoming_msg = request.json.get("message", "").strip()
-    user_state = request.json.get("state", {})
+    session_id = request.json.get("session_id") or uuid.uuid4().hex
     if not incoming_msg:
         return jsonify({"error": "Invalid request"}), 400
     
-    if not user_state:
-        user_state = {"messages": []}
-    
-    reply, updated_state = process_message(incoming_msg, user_state)
-    return jsonify({"reply": reply, "state": updated_state})
+    with tracing.request("/chat"):
+        with tracing.stage("session_load"):
+            session = Session.load(conversation_state.get(session_id), UAE_TZ)
+
+        reply, session = process_message(incoming_msg, session)
+        with tracing.stage("session_save"):
+            conversation_state.set(session_id, session.dump())
+    return jsonify({"reply": reply, "session_id": session_id})
+
+def staff_authorized():
+    # The bulk endpoint is off unless STAFF_API_TOKEN is set.
+    token = os.environ.get('STAFF_API_TOKEN')
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    return bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+
+@chat_routes.route("/appointments/bulk", methods=["POST"])
+def bulk_appointments():
+    if not staff_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    json_lines = request.mimetype in ("application/x-ndjson", "application/jsonl", "application/x-jsonlines")
+    try:
+        records = read_appointment_records(request.get_data(as_text=True), json_lines)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    with tracing.request("/appointments/bulk"):
+        outcome = book_appointments(records)
+    return jsonify(outcome)
+
+@chat_routes.cli.command("import-appointments", help="Book the appointments in a JSON-lines file.")
+@click.argument("path", type=click.File())
+def import_appointments(path):
+    outcome = book_appointments(read_appointment_records(path.read(), json_lines=True))
+    for result in outcome["results"]:
+        if result["status"] != "booked":
+            click.echo(f"line {result['index'] + 1}: {result['status']}: {result.get('error', '')}")
+    click.echo(f"booked {outcome['booked']} of {len(outcome['results'])} appointments")
+
+def sse_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+@chat_routes.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    incoming_msg = request.json.get("message", "").strip()
+    session_id = request.json.get("session_id") or uuid.uuid4().hex
+    if not incoming_msg:
+        return jsonify({"error": "Invalid request"}), 400
+
+    session = Session.load(conversation_state.get(session_id), UAE_TZ)
+
+    def save():
+        with tracing.stage("session_save"):
+            conversation_state.set(session_id, session.dump())
+
+    def events():
+        yield sse_event("session", {"session_id": session_id})
+        with tracing.request("/chat/stream"):
+            try:
+                for chunk in stream_message(incoming_msg, session, save):
+                    if chunk:
+                        yield sse_event("delta", {"html": chunk})
+            except Exception:
+                logger.exception("streamed reply failed")
+                yield sse_event("error", {"error": "Sorry, an error occurred. Please try again."})
+                return
+        yield sse_event("done", {})
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def app_metrics():
+    # State kept elsewhere in the app, read at scrape time.
+    with assistant_calls_lock:
+        turns = dict(assistant_calls)
+    for outcome, count in sorted(turns.items()):
+        yield ("reservo_assistant_turns_total", "counter", "Chat turns by how the Assistant was involved.",
+               {"outcome": outcome}, count)
+    cache = answer_cache.stats()
+    for result in ("hits", "similar_hits", "misses", "uncacheable"):
+        yield ("reservo_answer_cache_lookups_total", "counter", "Answer cache lookups by result.",
+               {"result": result}, cache.get(result, 0))
+    yield "reservo_answer_cache_entries", "gauge", "Answers currently cached.", {}, cache["entries"]
+    for cache_name, info in (("nlp", message_parser.cache_info()), ("dates", date_cache_info())):
+        for result, count in (("hits", info.hits), ("misses", info.misses)):
+            yield ("reservo_parse_cache_lookups_total", "counter", "Memoized message parses by cache and result.",
+                   {"cache": cache_name, "result": result}, count)
+
+tracing.registry.add_collector(app_metrics)
+
+@chat_routes.route("/metrics")
+def metrics():
+    # Each gunicorn worker keeps its own figures; a scrape sees whichever
+    # worker answers it.
+    return Response(tracing.registry.render(), mimetype="text/plain; version=0.0.4")
+
+def warm_up():
+    # Called in the gunicorn master when the app is preloaded: the model is
+    # then loaded once and shared copy-on-write by every forked worker.
+    message_parser.parse("Book a haircut and styling tomorrow at 3pm")
+    # The request path imports openai on first use; importing it here lets
+    # the workers share the loaded module as well.
+    import openai
+
+    try:
+        get_calendar_service()
+    except Exception as e:
+        logger.warning("calendar client not built ahead of time: %s", e)
+
+def create_app(assistant=None, calendar=None):
+    use_backends(assistant, calendar)
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(chat_routes)
+    return flask_app
+
+app = create_app()
 
 if __name__ == "__main__":
     app.run(port=8080, debug=True)
@@ -0,0 +1,110 @@
+import logging
+import time
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+PENDING_STATUSES = ("queued", "in_progress", "cancelling")
+FAILED_RUN_EVENTS = ("thread.run.failed", "thread.run.expired", "thread.run.cancelled",
+                     "thread.run.incomplete", "thread.run.requires_action")
+
+
+class AssistantError(Exception):
+    pass
+
+
+def cancel_run(client, thread_id, run_id):
+    import openai
+
+    try:
+        with tracing.external_call("openai.runs.cancel"):
+            client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except openai.OpenAIError as e:
+        logger.warning("could not cancel run %s: %s", run_id, e)
+
+
+def wait_for_run(client, thread_id, run, timeout=60, initial_delay=0.2, max_delay=2.0, sleep=time.sleep):
+    # Poll with bounded exponential backoff instead of spinning. Under the
+    # gevent workers set up in gunicorn.conf.py the sleep and the HTTP calls
+    # yield, so the worker serves other conversations while this run is going.
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while run.status in PENDING_STATUSES:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            cancel_run(client, thread_id, run.id)
+            raise AssistantError(f"run {run.id} did not finish within {timeout}s")
+        sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+        tracing.count_poll()
+        with tracing.external_call("openai.runs.retrieve"):
+            run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+    if run.status != "completed":
+        if run.status == "requires_action":
+            cancel_run(client, thread_id, run.id)
+        error = getattr(run, "last_error", None)
+        raise AssistantError(f"run {run.id} ended with status {run.status}" + (f": {error.message}" if error else ""))
+    return run
+
+
+def start_run(client, assistant_id, messages, thread_id=None, history_window=None, stream=False, timeout=None):
+    # A conversation keeps one thread; only the messages it has not seen yet
+    # are sent, and the run only reads the last history_window of them. With
+    # stream=True the run comes back as a stream of server-sent events.
+    # openai is imported on first use, as it takes most of the app's import
+    # time.
+    import openai
+
+    truncation = {"type": "last_messages", "last_messages": history_window} if history_window else openai.NOT_GIVEN
+    options = {"truncation_strategy": truncation, "stream": stream, "timeout": timeout or openai.NOT_GIVEN}
+    if thread_id is not None:
+        try:
+            with tracing.external_call("openai.runs.create"):
+                run = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id,
+                                                      additional_messages=messages or openai.NOT_GIVEN, **options)
+            return thread_id, run
+        except openai.NotFoundError:
+            logger.info("thread %s is gone, starting a new one", thread_id)
+    with tracing.external_call("openai.threads.create"):
+        thread_id = client.beta.threads.create(messages=messages).id
+    with tracing.external_call("openai.runs.create"):
+        run = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id, **options)
+    return thread_id, run
+
+
+def finish_run(client, thread_id, run, timeout=60):
+    wait_for_run(client, thread_id, run, timeout=timeout)
+    with tracing.external_call("openai.messages.list"):
+        message_response = client.beta.threads.messages.list(thread_id=thread_id, limit=1)
+    return message_response.data[0].content[0].text.value
+
+
+def stream_text(client, thread_id, events, timeout=60):
+    # Yields the reply text as the run produces it; the same deadline and
+    # failure handling as wait_for_run apply.
+    began = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    run_id = None
+    try:
+        for event in events:
+            if event.event == "thread.run.created":
+                run_id = event.data.id
+            elif event.event == "thread.message.delta":
+                for part in event.data.delta.content or []:
+                    if part.type == "text" and part.text and part.text.value:
+                        yield part.text.value
+            elif event.event in FAILED_RUN_EVENTS:
+                if event.event == "thread.run.requires_action":
+                    cancel_run(client, thread_id, event.data.id)
+                raise AssistantError(f"run {event.data.id} ended with {event.event}")
+            elif event.event == "error":
+                raise AssistantError(f"run stream failed: {event.data.message}")
+            if time.monotonic() > deadline:
+                if run_id:
+                    cancel_run(client, thread_id, run_id)
+                raise AssistantError(f"run {run_id} did not finish within {timeout}s")
+    finally:
+        events.close()
+        # The whole stream is one HTTP response.
+        tracing.record_call("openai.runs.stream", time.perf_counter() - began)
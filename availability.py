@@ -0,0 +1,240 @@
+import bisect
+import datetime
+import functools
+import heapq
+import math
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+
+def parse_event_time(value, tz):
+    if 'dateTime' in value:
+        dt = datetime.datetime.fromisoformat(value['dateTime'])
+        if dt.tzinfo is None:
+            dt = tz.localize(dt)
+        return dt
+    day = datetime.date.fromisoformat(value['date'])
+    return tz.localize(datetime.datetime.combine(day, datetime.time()))
+
+
+# Local copy of the busy blocks of one calendar. Events are pulled once with a
+# full events.list and then kept fresh with sync tokens, so availability checks
+# are answered from memory instead of a Calendar round-trip per message.
+# _sync_lock lets one caller at a time talk to Calendar; _lock only guards the
+# in-memory blocks and is never held across a request, so a check waits at
+# most for a sync's results to be applied.
+class BusyIndex:
+    def __init__(self, service_factory, calendar_id, tz, max_staleness=30, lookback_days=1):
+        self.service_factory = service_factory
+        self.calendar_id = calendar_id
+        self.tz = tz
+        self.max_staleness = max_staleness
+        self.lookback_days = lookback_days
+        self._sync_lock = threading.Lock()
+        self._lock = threading.RLock()
+        self._events = {}
+        self._starts = []
+        self._intervals = []
+        self._max_ends = []
+        self._dirty = False
+        self._sync_token = None
+        self._last_sync = None
+
+    def sync(self):
+        with self._sync_lock:
+            self._sync()
+
+    def ensure_fresh(self):
+        if not self._stale():
+            return
+        with self._sync_lock:
+            # Callers that waited on the lock find the index already synced by
+            # the one that held it, rather than each listing the calendar again.
+            if self._stale():
+                self._sync()
+
+    def _stale(self):
+        return self._last_sync is None or time.monotonic() - self._last_sync >= self.max_staleness
+
+    def add_event(self, event):
+        with self._lock:
+            self._apply(event)
+
+    def is_free(self, start_time, end_time, sync=True):
+        # sync=False answers from memory alone, whatever its age.
+        if sync:
+            self.ensure_fresh()
+        with self._lock:
+            self._rebuild()
+            i = bisect.bisect_left(self._starts, end_time)
+            return i == 0 or self._max_ends[i - 1] <= start_time
+
+    def busy_intervals(self, start_time, end_time):
+        self.ensure_fresh()
+        with self._lock:
+            self._rebuild()
+            i = bisect.bisect_left(self._starts, end_time)
+            j = bisect.bisect_right(self._max_ends, start_time, 0, i)
+            return [(s, e) for s, e in self._intervals[j:i] if e > start_time]
+
+    def _sync(self):
+        if self._sync_token is None:
+            self._full_sync()
+            return
+        try:
+            self._incremental_sync()
+        except HttpError as e:
+            if e.resp.status != 410:
+                raise
+            # The sync token expired, start over from a full listing.
+            self._sync_token = None
+            self._full_sync()
+
+    def _full_sync(self):
+        service = self.service_factory()
+        time_min = datetime.datetime.now(self.tz) - datetime.timedelta(days=self.lookback_days)
+        params = {
+            'calendarId': self.calendar_id,
+            'timeMin': time_min.isoformat(),
+            'singleEvents': True,
+        }
+        # The old blocks keep answering checks until the listing is complete.
+        items, sync_token = self._list_pages(service, params)
+        with self._lock:
+            self._events = {}
+            self._dirty = True
+            self._store(items, sync_token)
+
+    def _incremental_sync(self):
+        service = self.service_factory()
+        params = {
+            'calendarId': self.calendar_id,
+            'syncToken': self._sync_token,
+            'singleEvents': True,
+        }
+        items, sync_token = self._list_pages(service, params)
+        with self._lock:
+            self._store(items, sync_token)
+
+    def _list_pages(self, service, params):
+        items = []
+        page_token = None
+        while True:
+            if page_token:
+                params['pageToken'] = page_token
+            result = service.events().list(**params).execute()
+            items.extend(result.get('items', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+        return items, result.get('nextSyncToken')
+
+    def _store(self, items, sync_token):
+        for event in items:
+            self._apply(event)
+        self._sync_token = sync_token
+        self._last_sync = time.monotonic()
+
+    def _apply(self, event):
+        event_id = event.get('id')
+        if event.get('status') == 'cancelled':
+            if self._events.pop(event_id, None) is not None:
+                self._dirty = True
+            return
+        if 'start' not in event or 'end' not in event:
+            return
+        start = parse_event_time(event['start'], self.tz)
+        end = parse_event_time(event['end'], self.tz)
+        self._events[event_id] = (start, end)
+        self._dirty = True
+
+    def _rebuild(self):
+        if not self._dirty:
+            return
+        self._intervals = sorted(self._events.values())
+        self._starts = [s for s, _ in self._intervals]
+        self._max_ends = []
+        running = None
+        for _, e in self._intervals:
+            running = e if running is None or e > running else running
+            self._max_ends.append(running)
+        self._dirty = False
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+@functools.lru_cache(maxsize=4096)
+def business_hours(day, tz, opening, closing):
+    return (tz.localize(datetime.datetime.combine(day, opening)).timestamp(),
+            tz.localize(datetime.datetime.combine(day, closing)).timestamp())
+
+
+def free_windows(busy, horizon_start, horizon_end, tz, opening, closing):
+    # One sorted-merge pass over the busy blocks and the business hours of
+    # every day in the horizon, on POSIX timestamps to keep it cheap. Each
+    # window is (start, end, opening time of its day).
+    merged = merge_intervals((s.timestamp(), e.timestamp()) for s, e in busy)
+    horizon_start_ts = horizon_start.timestamp()
+    horizon_end_ts = horizon_end.timestamp()
+    windows = []
+    i = 0
+    day = horizon_start.astimezone(tz).date()
+    last_day = horizon_end.astimezone(tz).date()
+    while day <= last_day:
+        day_open, day_close = business_hours(day, tz, opening, closing)
+        day += datetime.timedelta(days=1)
+        open_at = max(day_open, horizon_start_ts)
+        close_at = min(day_close, horizon_end_ts)
+        if open_at >= close_at:
+            continue
+        while i < len(merged) and merged[i][1] <= open_at:
+            i += 1
+        cursor = open_at
+        j = i
+        while j < len(merged) and merged[j][0] < close_at:
+            if merged[j][0] > cursor:
+                windows.append((cursor, merged[j][0], day_open))
+            cursor = max(cursor, merged[j][1])
+            j += 1
+        if cursor < close_at:
+            windows.append((cursor, close_at, day_open))
+    return windows
+
+
+def candidate_slots(windows, requested, duration, step, count):
+    # Within a window the distance to the requested time grows on both sides
+    # of the nearest aligned start, so only count slots each way can matter.
+    for window_start, window_end, day_open in windows:
+        first = day_open + math.ceil((window_start - day_open) / step) * step
+        last_index = math.floor((window_end - duration - first) / step)
+        if last_index < 0:
+            continue
+        nearest = min(max(round((requested - first) / step), 0), last_index)
+        for k in range(max(nearest - count, 0), min(nearest + count, last_index) + 1):
+            yield first + k * step
+
+
+def best_slots(busy, requested, duration, horizon_start, horizon_end, tz,
+               opening=datetime.time(9), closing=datetime.time(18),
+               step=datetime.timedelta(minutes=15), count=3):
+    windows = free_windows(busy, horizon_start, horizon_end, tz, opening, closing)
+    requested_ts = requested.timestamp()
+    duration_s = duration.total_seconds()
+    starts = heapq.nsmallest(count, candidate_slots(windows, requested_ts, duration_s, step.total_seconds(), count),
+                             key=lambda ts: (abs(ts - requested_ts), ts))
+    slots = []
+    for ts in starts:
+        slot = datetime.datetime.fromtimestamp(ts, tz)
+        slots.append((slot, slot + duration))
+    return slots
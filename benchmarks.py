@@ -0,0 +1,419 @@
+import argparse
+import datetime
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytz
+from dateutil import parser as dateutil_parser
+
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.discovery import build
+
+from availability import BusyIndex, best_slots, parse_event_time
+from calendar_client import CalendarClientManager
+from fake_calendar import FakeCalendarServer, FakeCalendarService
+from reservations import create_reservation_book
+from scheduling import ResourceScheduler
+from temporal import cache_info, parse_when
+
+UAE_TZ = pytz.timezone('Asia/Dubai')
+CALENDAR_ID = 'bench'
+
+
+def synthetic_calendar(days=30, per_day=6, latency=0.0, seed=1):
+    rng = random.Random(seed)
+    service = FakeCalendarService(latency=latency)
+    today = datetime.datetime.now(UAE_TZ).replace(hour=9, minute=0, second=0, microsecond=0)
+    for d in range(days):
+        day = today + datetime.timedelta(days=d)
+        for quarter in sorted(rng.sample(range(36), per_day)):
+            start = day + datetime.timedelta(minutes=15 * quarter)
+            service.add_event(start, start + datetime.timedelta(minutes=rng.choice([30, 45, 60])),
+                              calendar_id=CALENDAR_ID)
+    return service, today
+
+
+def random_slots(today, count, days=30, seed=2):
+    rng = random.Random(seed)
+    slots = []
+    for _ in range(count):
+        start = today + datetime.timedelta(days=rng.randrange(days), minutes=15 * rng.randrange(32))
+        slots.append((start, start + datetime.timedelta(hours=1)))
+    return slots
+
+
+def rate(fn, slots):
+    began = time.perf_counter()
+    for start, end in slots:
+        fn(start, end)
+    elapsed = time.perf_counter() - began
+    return len(slots) / elapsed
+
+
+def bench_availability(args):
+    service, today = synthetic_calendar(latency=args.latency)
+    slots = random_slots(today, args.checks)
+
+    def query(start, end):
+        result = service.events().list(calendarId=CALENDAR_ID, timeMin=start.isoformat(),
+                                       timeMax=end.isoformat(), singleEvents=True,
+                                       orderBy='startTime').execute()
+        return len(result.get('items', [])) == 0
+
+    index = BusyIndex(lambda: service, CALENDAR_ID, UAE_TZ)
+    index.sync()
+    mismatches = sum(query(s, e) != index.is_free(s, e) for s, e in slots[:200])
+    print('availability: %d checks, %.1f ms simulated Calendar latency' % (len(slots), args.latency * 1000))
+    print('  events.list per check: %10.1f checks/sec' % rate(query, slots[:max(1, len(slots) // 20)]))
+    print('  busy index:            %10.1f checks/sec' % rate(index.is_free, slots))
+    print('  mismatches on first 200 checks: %d' % mismatches)
+
+
+def bench_client(args):
+    rounds = max(1, args.checks // 100)
+
+    def rebuild():
+        return build('calendar', 'v3', credentials=AnonymousCredentials())
+
+    manager = CalendarClientManager(None, [], credentials_factory=AnonymousCredentials)
+    manager.service()
+
+    def cached():
+        return manager.service()
+
+    print('client: %d request constructions' % rounds)
+    for label, fn in (('build per call', rebuild), ('client manager', cached)):
+        began = time.perf_counter()
+        for _ in range(rounds):
+            fn().events().list(calendarId=CALENDAR_ID)
+        elapsed = time.perf_counter() - began
+        print('  %-15s %8.3f ms per request' % (label + ':', elapsed * 1000 / rounds))
+    print('  manager stats: %s' % manager.stats())
+
+
+def bench_slots(args):
+    print('slots: 3 best candidates for a 1 hour appointment')
+    for days, per_day in ((7, 8), (28, 8), (90, 12)):
+        service, today = synthetic_calendar(days=days, per_day=per_day)
+        index = BusyIndex(lambda: service, CALENDAR_ID, UAE_TZ)
+        index.sync()
+        horizon_end = today + datetime.timedelta(days=days)
+        busy = index.busy_intervals(today, horizon_end)
+        requests = random_slots(today, 200, days=days)
+        began = time.perf_counter()
+        for start, _ in requests:
+            best_slots(busy, start, datetime.timedelta(hours=1), today, horizon_end, UAE_TZ)
+        elapsed = time.perf_counter() - began
+        print('  %3d day horizon, %5d busy blocks: %7.3f ms per search'
+              % (days, len(busy), elapsed * 1000 / len(requests)))
+
+
+def overlapping_events(service):
+    events = sorted((e['calendarId'], parse_event_time(e['start'], UAE_TZ), parse_event_time(e['end'], UAE_TZ))
+                    for e in service._events.values())
+    return [(a, b) for a, b in zip(events, events[1:]) if a[0] == b[0] and b[1] < a[2]]
+
+
+BOOKING_PHRASES = [
+    "Book a classic manicure for next Tuesday at 10 AM",
+    "Can I schedule a facial treatment tomorrow at 3pm?",
+    "What are your prices for hair coloring?",
+    "I'd like an appointment on Friday afternoon",
+    "My name is Sarah Ahmed and my number is 0501234567",
+    "yes",
+    "Do you do bridal makeup on weekends?",
+    "book waxing on 12 August at 11:30",
+]
+
+
+def _nlp_worker(exclude, messages):
+    from text_pipeline import load_pipeline
+
+    began = time.perf_counter()
+    nlp = load_pipeline(exclude=exclude)
+    load_seconds = time.perf_counter() - began
+    began = time.perf_counter()
+    for message in messages:
+        nlp(message)
+    per_message = (time.perf_counter() - began) / len(messages)
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return load_seconds, per_message, rss_mb
+
+
+def bench_nlp(args):
+    from text_pipeline import SPACY_EXCLUDE
+
+    messages = [BOOKING_PHRASES[i % len(BOOKING_PHRASES)] for i in range(args.checks)]
+    context = multiprocessing.get_context('spawn')
+    print('nlp: %d messages' % len(messages))
+    for label, exclude in (('full pipeline', []), ('trimmed', SPACY_EXCLUDE)):
+        # A fresh interpreter per configuration keeps the RSS figures apart.
+        with context.Pool(1) as pool:
+            load_seconds, single, rss_mb = pool.apply(_nlp_worker, (exclude, messages))
+        print('  %-14s load %6.2f s  nlp() %6.3f ms/msg  peak RSS %6.1f MB'
+              % (label + ':', load_seconds, single * 1000, rss_mb))
+
+
+def bench_bulk(args):
+    pools = {'staff': ['stylist-%d@example.com' % i for i in range(1, 6)]}
+    count = min(args.checks, 200)
+    today = datetime.datetime.now(UAE_TZ).replace(hour=9, minute=0, second=0, microsecond=0)
+    bookings = []
+    for start, end in random_slots(today + datetime.timedelta(days=1), count, days=14, seed=3):
+        event = {'summary': 'Walk-in', 'start': {'dateTime': start.isoformat()}, 'end': {'dateTime': end.isoformat()}}
+        bookings.append((None, start, end, event))
+    print('bulk: %d appointments, %d calendars, %.1f ms per round trip to a local fake Calendar server'
+          % (count, len(pools['staff']), args.latency * 1000))
+    for label in ('one by one', 'book_many'):
+        server = FakeCalendarServer(latency=args.latency).start()
+        try:
+            manager = CalendarClientManager(None, [], credentials_factory=AnonymousCredentials, root_url=server.root_url)
+            scheduler = ResourceScheduler(pools, manager.service, UAE_TZ, create_reservation_book('memory://'))
+            began = time.perf_counter()
+            if label == 'one by one':
+                booked = sum(bool(scheduler.book(*booking[:3], 'walk-in-%d' % i, booking[3]))
+                             for i, booking in enumerate(bookings))
+            else:
+                booked = sum(error is None for _, error in scheduler.book_many(bookings, 'walk-ins'))
+            elapsed = time.perf_counter() - began
+            overlaps = overlapping_events(server.service)
+        finally:
+            server.stop()
+        print('  %-11s %8.1f appointments/s, %4d HTTP requests, booked %d, overlapping events %d'
+              % (label + ':', count / elapsed, server.requests, booked, len(overlaps)))
+        assert not overlaps
+
+
+# Booking phrases as clients write them, with what they mean when said on
+# Monday 5 August 2024 at 10:00. None marks phrases the rule-based parser is
+# expected to leave to the dateutil fallback.
+DATE_NOW = UAE_TZ.localize(datetime.datetime(2024, 8, 5, 10, 0))
+DATE_PHRASES = [
+    ("next Monday at 2 PM", "2024-08-12 14:00"),
+    ("Can I schedule a facial treatment tomorrow at 3pm?", "2024-08-06 15:00"),
+    ("tomorrow at 11", "2024-08-06 11:00"),
+    ("Book a classic manicure for next Tuesday at 10 AM", "2024-08-06 10:00"),
+    ("book waxing on 12 August at 11:30", "2024-08-12 11:30"),
+    ("Friday at 4:30pm please", "2024-08-09 16:30"),
+    ("this thursday 2pm", "2024-08-08 14:00"),
+    ("coming Saturday at noon", "2024-08-10 12:00"),
+    ("Sunday 10am", "2024-08-11 10:00"),
+    ("today at 5", "2024-08-05 17:00"),
+    ("15:30", "2024-08-05 15:30"),
+    ("at 9", "2024-08-06 09:00"),
+    ("3 pm", "2024-08-05 15:00"),
+    ("the 12th at 3", "2024-08-12 15:00"),
+    ("on the 3rd at 5pm", "2024-09-03 17:00"),
+    ("August 20th at 1pm", "2024-08-20 13:00"),
+    ("20 aug 2pm", "2024-08-20 14:00"),
+    ("1st of September at 10:15", "2024-09-01 10:15"),
+    ("Sept 2 2025 at 11am", "2025-09-02 11:00"),
+    ("march 3rd at 4", "2025-03-03 16:00"),
+    ("day after tomorrow at 12pm", "2024-08-07 12:00"),
+    ("in 3 days at 2", "2024-08-08 14:00"),
+    ("in a week at 10am", "2024-08-12 10:00"),
+    ("tmrw 6 p.m.", "2024-08-06 18:00"),
+    ("Wednesday 11 o'clock", "2024-08-07 11:00"),
+    ("tomorrow", "2024-08-06 09:00"),
+    ("next fri", "2024-08-09 09:00"),
+    ("2024-08-14 16:00", "2024-08-14 16:00"),
+    ("May I book a haircut and styling tomorrow at 4?", "2024-08-06 16:00"),
+    ("I'd like an appointment on Friday afternoon", None),
+    ("tomorrow morning", None),
+    ("tonight", None),
+    ("this evening at 6", None),
+    ("next month on the 5th at 3pm", None),
+    ("this weekend at 2", None),
+    ("next week on tuesday at 3", None),
+    ("Saturday next week at 11am", None),
+    ("the 10th next month at 4pm", None),
+    ("Is Monday or Tuesday at 3pm free?", None),
+    ("book for 2 people on friday at 3pm", None),
+    ("sometime next week", None),
+    ("12/08 at 3pm", None),
+    ("first thing on the last day of the month", None),
+    ("my number is 0501234567", None),
+]
+
+
+def bench_dates(args):
+    hits = correct = expected_misses = 0
+    for phrase, expected in DATE_PHRASES:
+        parsed = parse_when(phrase, DATE_NOW)
+        if parsed is None:
+            expected_misses += expected is None
+            continue
+        hits += 1
+        if expected and parsed.strftime('%Y-%m-%d %H:%M') == expected:
+            correct += 1
+        else:
+            print('  wrong: %r -> %s, expected %s' % (phrase, parsed, expected))
+    print('dates: %d phrases, fast path hit rate %.0f%%, %d/%d hits correct, %d/%d expected misses'
+          % (len(DATE_PHRASES), 100 * hits / len(DATE_PHRASES), correct, hits, expected_misses,
+             sum(expected is None for _, expected in DATE_PHRASES)))
+
+    phrases = [phrase for phrase, _ in DATE_PHRASES]
+    rounds = max(1, args.checks // len(phrases))
+    # The memo is keyed on the day too, so a new day per round keeps it cold.
+    cold = [(phrase, DATE_NOW + datetime.timedelta(days=i + 1)) for i in range(rounds) for phrase in phrases]
+    warm = phrases * rounds
+    began = time.perf_counter()
+    for phrase, now in cold:
+        parse_when(phrase, now)
+    cold_rate = len(cold) / (time.perf_counter() - began)
+    began = time.perf_counter()
+    for phrase in warm:
+        parse_when(phrase, DATE_NOW)
+    warm_rate = len(warm) / (time.perf_counter() - began)
+    began = time.perf_counter()
+    for phrase in warm:
+        try:
+            dateutil_parser.parse(phrase, fuzzy=True)
+        except (ValueError, OverflowError):
+            pass
+    fallback_rate = len(warm) / (time.perf_counter() - began)
+    print('  rule-based %9.0f parses/s uncached, %9.0f parses/s memoized (%s)'
+          % (cold_rate, warm_rate, cache_info()))
+    print('  dateutil fuzzy fallback %9.0f parses/s' % fallback_rate)
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMPORT_PROBE = '''
+import resource, time
+began = time.perf_counter()
+import app
+imported = time.perf_counter() - began
+imported_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+began = time.perf_counter()
+app.warm_up()
+warmed = time.perf_counter() - began
+print(imported, imported_rss, warmed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+'''
+
+
+def _memory_mb(pid):
+    # VmRSS counts shared pages in full for every process; Pss splits them
+    # between the processes sharing them, so it shows what preloading saves.
+    values = {}
+    for name in ('status', 'smaps_rollup'):
+        try:
+            with open('/proc/%d/%s' % (pid, name)) as f:
+                for line in f:
+                    key, _, rest = line.partition(':')
+                    if key in ('VmRSS', 'Pss'):
+                        values[key] = int(rest.split()[0]) / 1024
+        except OSError:
+            pass
+    return values.get('VmRSS', 0.0), values.get('Pss', 0.0)
+
+
+def _children(pid):
+    try:
+        with open('/proc/%d/task/%d/children' % (pid, pid)) as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _responds(port):
+    try:
+        urllib.request.urlopen('http://127.0.0.1:%d/' % port, timeout=1)
+    except urllib.error.HTTPError:
+        pass
+    except OSError:
+        return False
+    return True
+
+
+def _wait_for_workers(master, port, workers, timeout=120):
+    # A worker is taken as ready once the server answers and no worker's
+    # RSS has moved for a couple of samples (i.e. it is done loading).
+    deadline = time.monotonic() + timeout
+    previous = None
+    steady = 0
+    while time.monotonic() < deadline:
+        if master.poll() is not None:
+            raise RuntimeError('gunicorn exited with status %d' % master.returncode)
+        pids = _children(master.pid)
+        sample = [round(_memory_mb(pid)[0]) for pid in pids]
+        if len(pids) == workers and sample == previous and _responds(port):
+            steady += 1
+            if steady >= 2:
+                return pids
+        else:
+            steady = 0
+        previous = sample
+        time.sleep(0.5)
+    raise RuntimeError('gunicorn workers did not settle within %ds' % timeout)
+
+
+def bench_startup(args):
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        print('startup: needs Linux /proc to measure worker memory')
+        return
+    output = subprocess.run([sys.executable, '-c', IMPORT_PROBE], cwd=HERE, check=True,
+                            capture_output=True, text=True).stdout.split()
+    imported, imported_rss, warmed, warmed_rss = map(float, output[-4:])
+    print('startup: import app %.2f s (peak RSS %.1f MB), warm_up() %.2f s (peak RSS %.1f MB)'
+          % (imported, imported_rss, warmed, warmed_rss))
+    for preload in ('1', '0'):
+        port = _free_port()
+        began = time.perf_counter()
+        master = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+                                   '--bind', '127.0.0.1:%d' % port, '--workers', str(args.workers), 'app:app'],
+                                  cwd=HERE, env=dict(os.environ, GUNICORN_PRELOAD=preload),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            pids = _wait_for_workers(master, port, args.workers)
+            ready = time.perf_counter() - began
+            memory = [_memory_mb(pid) for pid in pids]
+            master_pss = _memory_mb(master.pid)[1]
+        finally:
+            master.terminate()
+            master.wait()
+        print('  %-11s %d workers ready in %5.2f s, per worker RSS %6.1f MB  PSS %6.1f MB, total PSS %6.1f MB'
+              % ('preload:' if preload == '1' else 'no preload:', args.workers, ready,
+                 sum(rss for rss, _ in memory) / len(memory), sum(pss for _, pss in memory) / len(memory),
+                 master_pss + sum(pss for _, pss in memory)))
+
+
+BENCHMARKS = {
+    'availability': bench_availability,
+    'bulk': bench_bulk,
+    'client': bench_client,
+    'dates': bench_dates,
+    'nlp': bench_nlp,
+    'slots': bench_slots,
+    'startup': bench_startup,
+}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Offline benchmarks for ReservoAI')
+    arg_parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['all'])
+    arg_parser.add_argument('--latency', type=float, default=0.05,
+                            help='simulated round-trip to external services, in seconds')
+    arg_parser.add_argument('--checks', type=int, default=2000)
+    arg_parser.add_argument('--workers', type=int, default=4, help='gunicorn workers for the startup benchmark')
+    args = arg_parser.parse_args()
+    names = sorted(BENCHMARKS) if args.benchmark == 'all' else [args.benchmark]
+    for name in names:
+        BENCHMARKS[name](args)
+
+
+if __name__ == '__main__':
+    main()
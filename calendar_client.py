@@ -0,0 +1,144 @@
+import contextlib
+import json
+import logging
+import queue
+import threading
+import time
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+def _pooled_request_class(manager):
+    # googleapiclient and the auth transports are imported here rather than
+    # at module level so importing the app stays cheap until the first call.
+    from googleapiclient.http import HttpRequest
+
+    class PooledHttpRequest(HttpRequest):
+        def execute(self, http=None, num_retries=0):
+            if http is not None:
+                return super().execute(http=http, num_retries=num_retries)
+            began = time.perf_counter()
+            with manager.connection() as http:
+                try:
+                    return super().execute(http=http, num_retries=num_retries)
+                finally:
+                    manager.record(self.methodId, time.perf_counter() - began)
+
+    return PooledHttpRequest
+
+
+def _pooled_batch_class(manager):
+    from googleapiclient.http import BatchHttpRequest
+
+    class PooledBatchHttpRequest(BatchHttpRequest):
+        def execute(self, http=None):
+            if http is not None:
+                return super().execute(http=http)
+            began = time.perf_counter()
+            with manager.connection() as http:
+                try:
+                    return super().execute(http=http)
+                finally:
+                    manager.record('calendar.batch', time.perf_counter() - began)
+
+    return PooledBatchHttpRequest
+
+
+# Process-wide owner of the Calendar client. Credentials are loaded and the
+# (static) discovery document is parsed once; the resulting service object is
+# shared by every thread, while each request borrows its own authorized
+# httplib2 connection from a pool because httplib2.Http is not thread-safe.
+# Batch requests borrow from the same pool. root_url points the client at
+# another server, such as a local fake Calendar.
+class CalendarClientManager:
+    def __init__(self, service_account_file, scopes, pool_size=10, credentials_factory=None, root_url=None):
+        self.service_account_file = service_account_file
+        self.scopes = scopes
+        self.pool_size = pool_size
+        self.root_url = root_url
+        self.credentials_factory = credentials_factory or self._load_credentials
+        self._lock = threading.Lock()
+        self._credentials = None
+        self._service = None
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._stats = {}
+
+    def _load_credentials(self):
+        from google.oauth2 import service_account
+
+        return service_account.Credentials.from_service_account_file(
+            self.service_account_file, scopes=self.scopes)
+
+    @property
+    def credentials(self):
+        if self._credentials is None:
+            with self._lock:
+                if self._credentials is None:
+                    self._credentials = self.credentials_factory()
+        return self._credentials
+
+    def service(self):
+        if self._service is None:
+            credentials = self.credentials
+            with self._lock:
+                if self._service is None:
+                    began = time.perf_counter()
+                    self._service = self._build(credentials)
+                    self._record('build', time.perf_counter() - began)
+        return self._service
+
+    def _build(self, credentials):
+        from googleapiclient.discovery import build_from_document
+        from googleapiclient.discovery_cache import get_static_doc
+
+        # The same static document build(static_discovery=True) would use.
+        document = json.loads(get_static_doc('calendar', 'v3'))
+        if self.root_url:
+            document['rootUrl'] = self.root_url
+        service = build_from_document(document, credentials=credentials,
+                                      requestBuilder=_pooled_request_class(self))
+        batch_class = _pooled_batch_class(self)
+        batch_uri = document['rootUrl'] + document.get('batchPath', 'batch')
+        service.new_batch_http_request = lambda callback=None: batch_class(callback=callback, batch_uri=batch_uri)
+        return service
+
+    def new_http(self):
+        # All connections share one credentials object, so a token refreshed
+        # by any of them is reused by the rest.
+        import google_auth_httplib2
+        import httplib2
+
+        return google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=30))
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            http = self._pool.get_nowait()
+        except queue.Empty:
+            http = self.new_http()
+        try:
+            yield http
+        finally:
+            try:
+                self._pool.put_nowait(http)
+            except queue.Full:
+                pass
+
+    def record(self, method_id, seconds):
+        with self._lock:
+            self._record(method_id, seconds)
+        tracing.record_call(method_id, seconds)
+        logger.debug("calendar %s took %.1f ms", method_id, seconds * 1000)
+
+    def _record(self, name, seconds):
+        count, total = self._stats.get(name, (0, 0.0))
+        self._stats[name] = (count + 1, total + seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {'count': count, 'total_ms': total * 1000, 'avg_ms': total * 1000 / count}
+                for name, (count, total) in self._stats.items()
+            }
@@ -0,0 +1,68 @@
+import datetime
+
+# Where a conversation stands; each state has one handler in app.TURNS.
+IDLE, ASK_SERVICE, ASK_DATE_TIME, ASK_NAME, ASK_PHONE, SUGGESTED, NEW_TIME, CONFIRM = range(8)
+# A turn that is not owned by the current state: the client asked to book.
+BOOKING = 8
+# Bumped whenever the layout written by Session.dump changes; sessions in an
+# older layout start over.
+FORMAT = 2
+
+
+def _timestamp(moment):
+    return None if moment is None else int(moment.timestamp())
+
+
+def _moment(timestamp, tz):
+    return None if timestamp is None else datetime.datetime.fromtimestamp(timestamp, tz)
+
+
+# One chat session: the booking being put together, with its times kept as
+# datetimes, and the messages the Assistant's thread has not seen yet as
+# (role, content) pairs. personal is set once the client has said anything
+# about themselves, after which the Assistant's answers may draw on it and are
+# not shared. dump() turns it into a flat list of plain values for the session
+# store.
+class Session:
+    __slots__ = ("state", "service", "start", "end", "name", "phone", "suggested_start", "suggested_end",
+                 "hold_id", "thread_id", "messages", "personal")
+
+    def __init__(self):
+        self.state = IDLE
+        self.service = self.start = self.end = self.name = self.phone = None
+        self.suggested_start = self.suggested_end = None
+        self.hold_id = self.thread_id = None
+        self.messages = []
+        self.personal = False
+
+    def clear_appointment(self):
+        self.service = self.start = self.end = self.name = self.phone = None
+        self.suggested_start = self.suggested_end = None
+
+    def next_question(self):
+        # The first detail of the booking still missing, as the state that
+        # asks for it; CONFIRM once everything is known.
+        if self.service is None:
+            return ASK_SERVICE
+        if self.name is None:
+            return ASK_NAME
+        if self.phone is None:
+            return ASK_PHONE
+        return CONFIRM
+
+    def dump(self):
+        return [FORMAT, self.state, self.service, _timestamp(self.start), _timestamp(self.end), self.name,
+                self.phone, _timestamp(self.suggested_start), _timestamp(self.suggested_end), self.hold_id,
+                self.thread_id, [list(message) for message in self.messages], self.personal]
+
+    @classmethod
+    def load(cls, data, tz):
+        session = cls()
+        if not isinstance(data, list) or not data or data[0] != FORMAT:
+            return session
+        (_, session.state, session.service, start, end, session.name, session.phone, suggested_start,
+         suggested_end, session.hold_id, session.thread_id, messages, session.personal) = data
+        session.start, session.end = _moment(start, tz), _moment(end, tz)
+        session.suggested_start, session.suggested_end = _moment(suggested_start, tz), _moment(suggested_end, tz)
+        session.messages = [tuple(message) for message in messages]
+        return session
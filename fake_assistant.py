@@ -0,0 +1,137 @@
+import collections
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+
+# Canned answers picked by the first keyword found in the user's last
+# message, so a given question always gets the same reply.
+ANSWERS = [
+    ("price", "Here are some of our prices:\n* Classic Manicure: 120 AED\n* Deluxe Pedicure: 180 AED\n"
+              "* Facial Treatment: 350 AED\n* Hair Coloring: from 400 AED"),
+    ("hour", "We are open every day from 9 AM to 6 PM."),
+    ("open", "We are open every day from 9 AM to 6 PM."),
+    ("service", "We offer manicures, pedicures, facials, hair styling and coloring, waxing, eyelash "
+                "extensions, massages and bridal makeup."),
+    ("where", "You can find us in Dubai Marina, next to the metro station."),
+]
+DEFAULT_ANSWER = "I'd be happy to help with that. Is there a particular service you are interested in?"
+
+
+# In-memory stand-in for the parts of the OpenAI Assistants client the app
+# uses (threads, runs with polling or streaming, messages), so the chat flow
+# can be exercised and load-tested offline. A run takes `latency` seconds to
+# complete, whether it is polled or streamed.
+class FakeAssistantClient:
+    def __init__(self, latency=1.0, chunks=8):
+        self.latency = latency
+        self.chunks = chunks
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._threads = {}
+        self._runs = {}
+        self.beta = SimpleNamespace(threads=_Threads(self))
+
+    def _call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def _new_id(self, prefix):
+        return "%s_%d" % (prefix, next(self._ids))
+
+    def _answer(self, thread_id):
+        messages = self._threads[thread_id]
+        question = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "").lower()
+        return next((answer for keyword, answer in ANSWERS if keyword in question), DEFAULT_ANSWER)
+
+    def _stream(self, thread_id, run):
+        answer = self._answer(thread_id)
+        yield SimpleNamespace(event="thread.run.created", data=run)
+        size = max(1, -(-len(answer) // self.chunks))
+        for offset in range(0, len(answer), size):
+            time.sleep(self.latency / self.chunks)
+            part = SimpleNamespace(type="text", text=SimpleNamespace(value=answer[offset:offset + size]))
+            yield SimpleNamespace(event="thread.message.delta",
+                                  data=SimpleNamespace(delta=SimpleNamespace(content=[part])))
+        self._threads[thread_id].append({"role": "assistant", "content": answer})
+        yield SimpleNamespace(event="thread.run.completed", data=SimpleNamespace(id=run.id, status="completed"))
+
+
+class _Threads:
+    def __init__(self, client):
+        self.client = client
+        self.runs = _Runs(client)
+        self.messages = _Messages(client)
+
+    def create(self, messages=(), **kwargs):
+        self.client._call("threads.create")
+        thread_id = self.client._new_id("thread")
+        self.client._threads[thread_id] = list(messages)
+        return SimpleNamespace(id=thread_id)
+
+
+class _Runs:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, thread_id, assistant_id, additional_messages=None, stream=False, **kwargs):
+        client = self.client
+        client._call("runs.create")
+        if thread_id not in client._threads:
+            raise _not_found(thread_id)
+        if isinstance(additional_messages, list):
+            client._threads[thread_id].extend(additional_messages)
+        run = SimpleNamespace(id=client._new_id("run"), status="queued", last_error=None)
+        if stream:
+            return _EventStream(client._stream(thread_id, run))
+        client._runs[run.id] = (thread_id, time.monotonic() + client.latency)
+        return run
+
+    def retrieve(self, thread_id, run_id, **kwargs):
+        client = self.client
+        client._call("runs.retrieve")
+        thread_id, done_at = client._runs[run_id]
+        if time.monotonic() < done_at:
+            return SimpleNamespace(id=run_id, status="in_progress", last_error=None)
+        messages = client._threads[thread_id]
+        if not messages or messages[-1]["role"] != "assistant":
+            messages.append({"role": "assistant", "content": client._answer(thread_id)})
+        return SimpleNamespace(id=run_id, status="completed", last_error=None)
+
+    def cancel(self, thread_id, run_id, **kwargs):
+        self.client._call("runs.cancel")
+        return SimpleNamespace(id=run_id, status="cancelling")
+
+
+class _Messages:
+    def __init__(self, client):
+        self.client = client
+
+    def list(self, thread_id, limit=20, **kwargs):
+        self.client._call("messages.list")
+        messages = [m for m in reversed(self.client._threads[thread_id]) if m["role"] == "assistant"][:limit]
+        return SimpleNamespace(data=[
+            SimpleNamespace(role="assistant", content=[SimpleNamespace(text=SimpleNamespace(value=m["content"]))])
+            for m in messages
+        ])
+
+
+class _EventStream:
+    def __init__(self, events):
+        self._events = events
+
+    def __iter__(self):
+        return self._events
+
+    def close(self):
+        self._events.close()
+
+
+def _not_found(thread_id):
+    import httpx
+    import openai
+
+    request = httpx.Request("POST", "https://api.openai.com/v1/threads/%s/runs" % thread_id)
+    return openai.NotFoundError("No thread found with id '%s'." % thread_id,
+                                response=httpx.Response(404, request=request), body=None)
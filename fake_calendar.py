@@ -0,0 +1,274 @@
+import datetime
+import email.parser
+import email.policy
+import http.server
+import itertools
+import json
+import threading
+import time
+import urllib.parse
+
+
+# In-memory stand-in for the parts of the Google Calendar v3 client the app
+# uses, so availability code can be exercised and benchmarked offline.
+class FakeCalendarService:
+    def __init__(self, latency=0.0, page_size=250):
+        self.latency = latency
+        self.page_size = page_size
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._events = {}
+        self._changes = []
+        self._ids = itertools.count(1)
+
+    def events(self):
+        return _EventsResource(self)
+
+    def freebusy(self):
+        return _FreeBusyResource(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+    def add_event(self, start_time, end_time, summary='Busy', calendar_id='primary'):
+        return self._insert(calendar_id, {
+            'summary': summary,
+            'start': {'dateTime': start_time.isoformat()},
+            'end': {'dateTime': end_time.isoformat()},
+        })
+
+    def delete_event(self, event_id):
+        with self._lock:
+            event = self._events.pop(event_id, None)
+            if event is None:
+                raise KeyError(event_id)
+            event = dict(event, status='cancelled')
+            self._changes.append(event)
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _insert(self, calendar_id, body):
+        with self._lock:
+            event_id = str(next(self._ids))
+            event = dict(body, id=event_id, status='confirmed', calendarId=calendar_id,
+                         htmlLink='https://calendar.example/event/' + event_id)
+            self._events[event['id']] = event
+            self._changes.append(event)
+            return event
+
+    def _list(self, calendarId, timeMin=None, timeMax=None, syncToken=None, pageToken=None, **kwargs):
+        with self._lock:
+            if syncToken is not None:
+                items = self._changes[int(syncToken):]
+            else:
+                items = [e for e in self._events.values() if e['calendarId'] == calendarId]
+                items = [e for e in items if _overlaps(e, timeMin, timeMax)]
+                items.sort(key=lambda e: _event_time(e['start']))
+            items = [e for e in items if e['calendarId'] == calendarId]
+            offset = int(pageToken or 0)
+            page = items[offset:offset + self.page_size]
+            result = {'items': page}
+            if offset + self.page_size < len(items):
+                result['nextPageToken'] = str(offset + self.page_size)
+            else:
+                result['nextSyncToken'] = str(len(self._changes))
+            return result
+
+    def _freebusy(self, body):
+        with self._lock:
+            calendars = {}
+            for item in body.get('items', []):
+                events = [e for e in self._events.values()
+                          if e['calendarId'] == item['id'] and _overlaps(e, body['timeMin'], body['timeMax'])]
+                events.sort(key=lambda e: _event_time(e['start']))
+                calendars[item['id']] = {'busy': [{'start': e['start']['dateTime'], 'end': e['end']['dateTime']}
+                                                  for e in events]}
+            return {'kind': 'calendar#freeBusy', 'timeMin': body['timeMin'], 'timeMax': body['timeMax'],
+                    'calendars': calendars}
+
+
+class _EventsResource:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, **kwargs):
+        return _Request(self.service, lambda: self.service._list(**kwargs))
+
+    def insert(self, calendarId, body):
+        return _Request(self.service, lambda: self.service._insert(calendarId, body))
+
+    def delete(self, calendarId, eventId):
+        return _Request(self.service, lambda: self.service.delete_event(eventId))
+
+
+class _FreeBusyResource:
+    def __init__(self, service):
+        self.service = service
+
+    def query(self, body):
+        return _Request(self.service, lambda: self.service._freebusy(body))
+
+
+# Like googleapiclient's BatchHttpRequest: one round trip for all requests,
+# with a callback(request_id, response, exception) per request.
+class _Batch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request_id or str(len(self._requests) + 1), request, callback or self.callback))
+
+    def execute(self):
+        self.service._call()
+        for request_id, request, callback in self._requests:
+            try:
+                response, exception = request.fn(), None
+            except Exception as e:
+                response, exception = None, e
+            if callback is not None:
+                callback(request_id, response, exception)
+
+
+class _Request:
+    def __init__(self, service, fn):
+        self.service = service
+        self.fn = fn
+
+    def execute(self):
+        self.service._call()
+        return self.fn()
+
+
+def _event_time(value):
+    if 'dateTime' in value:
+        return datetime.datetime.fromisoformat(value['dateTime'])
+    return datetime.datetime.fromisoformat(value['date']).replace(tzinfo=datetime.timezone.utc)
+
+
+def _overlaps(event, time_min, time_max):
+    if time_min and _event_time(event['end']) <= datetime.datetime.fromisoformat(time_min):
+        return False
+    if time_max and _event_time(event['start']) >= datetime.datetime.fromisoformat(time_max):
+        return False
+    return True
+
+
+# Serves a FakeCalendarService over HTTP, speaking enough of the Calendar v3
+# REST and batch protocol for the real googleapiclient to talk to it (see
+# CalendarClientManager's root_url). Every HTTP round trip, batched or not,
+# costs `latency` seconds.
+class FakeCalendarServer:
+    def __init__(self, service=None, latency=0.0, host='127.0.0.1', port=0):
+        self.service = service or FakeCalendarService()
+        self.latency = latency
+        self.requests = 0
+        self._httpd = http.server.ThreadingHTTPServer((host, port), _handler_class(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def root_url(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://%s:%d/' % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def dispatch(self, method, target, body):
+        # Returns (status, payload) for one Calendar API call.
+        url = urllib.parse.urlsplit(target)
+        parts = [urllib.parse.unquote(part) for part in url.path.strip('/').split('/')]
+        query = dict(urllib.parse.parse_qsl(url.query))
+        query.pop('alt', None)
+        try:
+            if parts[:2] != ['calendar', 'v3']:
+                return 404, _error(404, 'Not Found')
+            if parts[2:] == ['freeBusy'] and method == 'POST':
+                return 200, self.service._freebusy(body)
+            if len(parts) >= 5 and parts[2] == 'calendars' and parts[4] == 'events':
+                calendar_id = parts[3]
+                if len(parts) == 5 and method == 'POST':
+                    return 200, self.service._insert(calendar_id, body)
+                if len(parts) == 5 and method == 'GET':
+                    return 200, self.service._list(calendarId=calendar_id, **query)
+                if len(parts) == 6 and method == 'DELETE':
+                    self.service.delete_event(parts[5])
+                    return 204, None
+        except KeyError:
+            return 404, _error(404, 'Not Found')
+        except ValueError as e:
+            return 400, _error(400, str(e))
+        return 404, _error(404, 'Not Found')
+
+
+def _error(code, message):
+    return {'error': {'code': code, 'message': message}}
+
+
+def _handler_class(server):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            self._handle()
+
+        def do_POST(self):
+            self._handle()
+
+        def do_DELETE(self):
+            self._handle()
+
+        def _handle(self):
+            server.requests += 1
+            if server.latency:
+                time.sleep(server.latency)
+            raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if self.path.startswith('/batch/'):
+                content_type, body = self._batch(raw)
+                self._respond(200, content_type, body)
+                return
+            status, payload = server.dispatch(self.command, self.path, json.loads(raw) if raw else None)
+            self._respond(status, 'application/json', json.dumps(payload).encode() if payload is not None else b'')
+
+        def _batch(self, raw):
+            # Each part of the multipart/mixed body is a whole HTTP request;
+            # the answers go back in the same order, tied by Content-ID.
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + raw)
+            boundary = 'batch_response'
+            out = []
+            for part in message.iter_parts():
+                request = part.get_payload(decode=True).decode()
+                head, _, body = request.partition('\r\n\r\n') if '\r\n\r\n' in request else request.partition('\n\n')
+                method, target = head.split(None, 2)[:2]
+                status, payload = server.dispatch(method, target, json.loads(body) if body.strip() else None)
+                text = json.dumps(payload) if payload is not None else ''
+                content_id = part['Content-ID'].strip('<>')
+                out.append('--%s\r\nContent-Type: application/http\r\nContent-ID: <response-%s>\r\n\r\n'
+                           'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s\r\n'
+                           % (boundary, content_id, status, 'OK' if status < 400 else 'Error', len(text), text))
+            out.append('--%s--\r\n' % boundary)
+            return 'multipart/mixed; boundary=%s' % boundary, ''.join(out).encode()
+
+        def _respond(self, status, content_type, body):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
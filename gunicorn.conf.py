@@ -0,0 +1,55 @@
+import gc
+import os
+
+bind = "0.0.0.0:" + os.environ.get("PORT", "8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+# With gevent each request runs in a greenlet, and waiting on the Assistant
+# (the polling sleep, the HTTP calls, a streamed run) or on Calendar hands the
+# worker to the other requests, so one worker keeps up to worker_connections
+# conversations in flight. GUNICORN_WORKER_CLASS=gthread brings back threads,
+# where each request holds one of GUNICORN_THREADS threads while it waits.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+if worker_class == "gevent":
+    # Patched here, before the app is preloaded, so the locks, thread-locals
+    # and queues it creates at import are gevent's too.
+    from gevent import monkey
+
+    monkey.patch_all()
+# Sessions and slot holds must be seen by every worker, or a conversation
+# loses its state (and its hold) whenever the next message lands on another
+# worker. With more than one worker both stores therefore default to SQLite
+# files under instance/, and the per-process memory store is refused.
+if workers > 1:
+    for name, path in (("SESSION_STORE", "instance/sessions.db"), ("RESERVATIONS_STORE", "instance/reservations.db")):
+        os.environ.setdefault(name, "sqlite:///" + path)
+        if os.environ[name] == "memory://":
+            raise RuntimeError("%s=memory:// is per process; use it with WEB_CONCURRENCY=1 or pick a shared store"
+                               % name)
+timeout = 60
+# Import the app once in the master and fork the workers from it, so the spaCy
+# model is loaded a single time and its memory is shared copy-on-write.
+# GUNICORN_PRELOAD=0 brings back one independent import per worker.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    import app
+
+    app.warm_up()
+    # Move everything loaded so far out of the collector's reach: otherwise
+    # the first collection in each worker touches (and so copies) every page
+    # the model's objects live on.
+    gc.freeze()
+    server.log.info("app warmed up in the master, workers share it")
+
+
+def post_worker_init(worker):
+    if preload_app:
+        return
+    import app
+
+    app.warm_up()
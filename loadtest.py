@@ -0,0 +1,248 @@
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytz
+
+from benchmarks import HERE, _free_port, _responds, overlapping_events
+from fake_calendar import FakeCalendarServer
+from scheduling import find_service
+
+UAE_TZ = pytz.timezone('Asia/Dubai')
+# Two of everything, so simultaneous requests for the same slot have to be
+# shared out between members of a pool rather than all refused.
+RESOURCES = {
+    'staff': ['front-desk'],
+    'nail_technician': ['nails-1', 'nails-2'],
+    'therapist': ['therapist-1', 'therapist-2'],
+    'treatment_room': ['room-1', 'room-2'],
+    'stylist': ['stylist-1', 'stylist-2'],
+}
+BOOKED_SERVICES = ['classic manicure', 'deluxe pedicure', 'facial treatment', 'haircut and styling',
+                   'massage therapy']
+QUESTIONS = ['What are your prices?', 'What are your opening hours?', 'Which services do you offer?',
+             'Where are you located?']
+# A few popular slots, so conversations compete for the same staff.
+HOURS = [10, 11, 14, 15]
+DAYS_AHEAD = [1, 2, 3]
+MAX_TURNS = 12
+SUGGESTED = re.compile(r"closest available slot is on (\d{4}-\d{2}-\d{2} \d{2}:\d{2} [ap]m)")
+
+
+def script(index, rng, today):
+    # A booking conversation holds what the client answers when asked;
+    # an informational one is just a couple of questions.
+    if rng.random() >= 0.7:
+        return {'questions': rng.sample(QUESTIONS, 2)}
+    day = today + datetime.timedelta(days=rng.choice(DAYS_AHEAD))
+    hour = rng.choice(HOURS)
+    service = rng.choice(BOOKED_SERVICES)
+    return {
+        'service': service,
+        'when': '%d %s at %d%s' % (day.day, day.strftime('%B'), hour % 12 or 12, 'pm' if hour >= 12 else 'am'),
+        'name': 'Guest%04d Loadtest' % index,
+        'phone': '+9715%08d' % index,
+    }
+
+
+def answer(conversation, reply):
+    reply = reply.lower()
+    if "i've booked your" in reply:
+        return None
+    suggested = SUGGESTED.search(reply)
+    if suggested:
+        # Asked again for a time later on, the client gives the one offered.
+        conversation['when'] = suggested.group(1)
+    if 'provide your full name' in reply:
+        return conversation['name']
+    if 'provide your phone number' in reply:
+        return conversation['phone']
+    if 'is this information correct' in reply or 'would you like to book this slot instead' in reply:
+        return 'Yes'
+    if 'what service would you like to book' in reply:
+        return conversation['service']
+    if any(prompt in reply for prompt in ('what date and time would you prefer', 'preferred date and time',
+                                          "didn't catch a date and time", 'try another time')):
+        return conversation['when']
+    return None
+
+
+def post(url, payload, timeout):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.load(response)
+
+
+def run_conversation(url, conversation, stats, timeout):
+    # Plays the client's side: the next message depends on what the bot
+    # asked for, the way a person would answer.
+    session_id = None
+    conversation = dict(conversation)
+    if 'questions' in conversation:
+        messages = iter(conversation['questions'])
+        message = next(messages)
+    else:
+        messages = None
+        message = 'I want to book a %s on %s' % (conversation['service'], conversation['when'])
+    for _ in range(MAX_TURNS):
+        began = time.perf_counter()
+        try:
+            body = post(url + '/chat', {'message': message, 'session_id': session_id}, timeout)
+        except (OSError, ValueError) as e:
+            stats.add(time.perf_counter() - began, error=e)
+            return 'error'
+        stats.add(time.perf_counter() - began)
+        session_id = body['session_id']
+        if messages is not None:
+            message = next(messages, None)
+            if message is None:
+                return 'answered'
+            continue
+        if "i've booked your" in body['reply'].lower():
+            return 'booked'
+        message = answer(conversation, body['reply'])
+        if message is None:
+            return 'gave up'
+    return 'gave up'
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.errors = collections.Counter()
+
+    def add(self, seconds, error=None):
+        with self._lock:
+            self.latencies.append(seconds)
+            if error is not None:
+                self.errors[type(error).__name__] += 1
+
+
+def start_server(args, tmpdir, calendar_url):
+    resources = os.path.join(tmpdir, 'resources.json')
+    with open(resources, 'w') as f:
+        json.dump(RESOURCES, f)
+    port = _free_port()
+    env = dict(os.environ,
+               CALENDAR_ROOT_URL=calendar_url,
+               FAKE_ASSISTANT_LATENCY=str(args.assistant_latency),
+               RESOURCES_FILE=resources,
+               SESSION_STORE='sqlite:///' + os.path.join(tmpdir, 'sessions.db'),
+               RESERVATIONS_STORE='sqlite:///' + os.path.join(tmpdir, 'reservations.db'),
+               WEB_CONCURRENCY=str(args.workers),
+               GUNICORN_WORKER_CLASS=args.worker_class,
+               GUNICORN_THREADS=str(args.threads))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+                               '--bind', '127.0.0.1:%d' % port, 'app:app'],
+                              cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 120
+    while not _responds(port):
+        if server.poll() is not None:
+            raise RuntimeError('gunicorn exited with status %d' % server.returncode)
+        if time.monotonic() > deadline:
+            server.terminate()
+            raise RuntimeError('gunicorn did not start within 120s')
+        time.sleep(0.5)
+    return server, 'http://127.0.0.1:%d' % port
+
+
+def check_bookings(calendar, conversations, outcomes):
+    # Every conversation told "booked" must own one event per resource its
+    # service ties up, nobody else may own any, and no calendar may be
+    # double-booked.
+    problems = ['double booking on %s: %s and %s' % (a[0], a[1], b[1]) for a, b in overlapping_events(calendar)]
+    owners = collections.Counter()
+    for event in calendar._events.values():
+        for line in event.get('description', '').splitlines():
+            if line.startswith('Name: '):
+                owners[line[len('Name: '):]] += 1
+    for conversation, outcome in zip(conversations, outcomes):
+        if 'name' not in conversation:
+            continue
+        expected = sum(find_service(conversation['service']).resources.values()) if outcome == 'booked' else 0
+        if owners[conversation['name']] != expected:
+            problems.append('%s: %s, but %d events' % (conversation['name'], outcome, owners[conversation['name']]))
+    return problems
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Replay scripted chats against /chat and measure them')
+    arg_parser.add_argument('--conversations', type=int, default=200)
+    arg_parser.add_argument('--concurrency', type=int, default=20, help='conversations in flight at once')
+    arg_parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    arg_parser.add_argument('--worker-class', default='gevent', help='gunicorn worker class: gevent or gthread')
+    arg_parser.add_argument('--threads', type=int, default=8, help='threads per gthread worker')
+    arg_parser.add_argument('--assistant-latency', type=float, default=1.0,
+                            help='seconds the fake Assistant takes per run')
+    arg_parser.add_argument('--calendar-latency', type=float, default=0.05,
+                            help='seconds the fake Calendar API takes per request')
+    arg_parser.add_argument('--url', help='test a server that is already running instead; '
+                                          'bookings are then not checked')
+    arg_parser.add_argument('--timeout', type=float, default=60)
+    arg_parser.add_argument('--seed', type=int, default=1)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    today = datetime.datetime.now(UAE_TZ).date()
+    conversations = [script(i, rng, today) for i in range(args.conversations)]
+
+    calendar = server = None
+    url = args.url
+    with tempfile.TemporaryDirectory() as tmpdir:
+        try:
+            if url is None:
+                calendar = FakeCalendarServer(latency=args.calendar_latency)
+                calendar.start()
+                server, url = start_server(args, tmpdir, calendar.root_url)
+            stats = Stats()
+            began = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(args.concurrency) as pool:
+                outcomes = list(pool.map(lambda c: run_conversation(url, c, stats, args.timeout), conversations))
+            elapsed = time.perf_counter() - began
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+            if calendar is not None:
+                calendar.stop()
+
+    counts = collections.Counter(outcomes)
+    latencies = sorted(stats.latencies)
+    cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    print('%d conversations, %d in flight, %.2f s Assistant / %.0f ms Calendar latency'
+          % (len(conversations), args.concurrency, args.assistant_latency, args.calendar_latency * 1000))
+    print('  requests:      %6d in %.1f s, %.1f req/s, %.2f conversations/s'
+          % (len(latencies), elapsed, len(latencies) / elapsed, len(conversations) / elapsed))
+    print('  latency:       p50 %7.1f ms  p95 %7.1f ms  p99 %7.1f ms  max %7.1f ms'
+          % (cuts[49] * 1000, cuts[94] * 1000, cuts[98] * 1000, latencies[-1] * 1000))
+    print('  outcomes:      %s' % ', '.join('%s %d' % item for item in sorted(counts.items())))
+    if stats.errors:
+        print('  errors:        %s' % ', '.join('%s %d' % item for item in sorted(stats.errors.items())))
+    failed = bool(stats.errors)
+    if calendar is not None:
+        problems = check_bookings(calendar.service, conversations, outcomes)
+        print('  bookings:      %d events, %s' % (len(calendar.service._events),
+                                                 'consistent' if not problems else '%d problems' % len(problems)))
+        for problem in problems[:10]:
+            print('    ' + problem)
+        failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+# Short-lived holds on resources for a time window. A slot is held for the
+# conversation it was offered to, so nobody else is offered it, and the hold
+# is committed once the calendar events exist. A committed hold only lasts
+# for ttl seconds, long enough for every worker's busy index to sync and see
+# the events; after that the calendars decide, so an appointment cancelled in
+# Google Calendar frees its slot again.
+# Every reserve() runs under one lock (a process lock or an immediate SQLite
+# transaction), which closes the gap between checking and booking a slot.
+class MemoryReservationBook:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._holds = []
+
+    def taken(self, start_time, end_time, exclude_owner=None):
+        with self._lock:
+            return {resource for resource, _, _ in self._overlapping(start_time.timestamp(), end_time.timestamp(),
+                                                                     exclude_owner)}
+
+    def blocks(self, start_time, end_time, exclude_owner=None):
+        with self._lock:
+            return self._overlapping(start_time.timestamp(), end_time.timestamp(), exclude_owner)
+
+    def reserve(self, owner, start_time, end_time, allocate, ttl):
+        start_ts, end_ts = start_time.timestamp(), end_time.timestamp()
+        with self._lock:
+            self._holds = [h for h in self._holds if not (h["owner"] == owner and not h["committed"])]
+            taken = {resource for resource, _, _ in self._overlapping(start_ts, end_ts, owner)}
+            allocation = allocate(taken)
+            if allocation is None:
+                return None
+            expires_at = time.time() + ttl
+            for resource in allocation:
+                self._holds.append({"owner": owner, "resource": resource, "start": start_ts, "end": end_ts,
+                                    "expires_at": expires_at, "committed": False})
+            return allocation
+
+    def commit(self, owner, ttl):
+        with self._lock:
+            expires_at = time.time() + ttl
+            for hold in self._holds:
+                if hold["owner"] == owner and not hold["committed"]:
+                    hold["committed"] = True
+                    hold["expires_at"] = expires_at
+
+    def release(self, owner):
+        with self._lock:
+            self._holds = [h for h in self._holds if not (h["owner"] == owner and not h["committed"])]
+
+    def _overlapping(self, start_ts, end_ts, exclude_owner):
+        now = time.time()
+        self._holds = [h for h in self._holds if h["expires_at"] > now]
+        return [(h["resource"], h["start"], h["end"]) for h in self._holds
+                if h["start"] < end_ts and h["end"] > start_ts and h["owner"] != exclude_owner]
+
+
+class SQLiteReservationBook:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # Like the session store, never keep the setup connection around to
+        # be inherited by forked workers.
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS holds (owner TEXT NOT NULL, resource TEXT NOT NULL, "
+                     "start_ts REAL NOT NULL, end_ts REAL NOT NULL, expires_at REAL NOT NULL, "
+                     "committed INTEGER NOT NULL DEFAULT 0)")
+        conn.execute("CREATE INDEX IF NOT EXISTS holds_window ON holds (start_ts, end_ts)")
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def taken(self, start_time, end_time, exclude_owner=None):
+        return {resource for resource, _, _ in self.blocks(start_time, end_time, exclude_owner)}
+
+    def blocks(self, start_time, end_time, exclude_owner=None):
+        return self._overlapping(self._connection(), start_time.timestamp(), end_time.timestamp(), exclude_owner)
+
+    def reserve(self, owner, start_time, end_time, allocate, ttl):
+        start_ts, end_ts = start_time.timestamp(), end_time.timestamp()
+        conn = self._connection()
+        # BEGIN IMMEDIATE takes the database write lock up front, so only one
+        # worker at a time can look at the holds and add its own.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            conn.execute("DELETE FROM holds WHERE expires_at <= ?", (now,))
+            conn.execute("DELETE FROM holds WHERE owner = ? AND committed = 0", (owner,))
+            taken = {resource for resource, _, _ in self._overlapping(conn, start_ts, end_ts, owner)}
+            allocation = allocate(taken)
+            if allocation is not None:
+                conn.executemany("INSERT INTO holds (owner, resource, start_ts, end_ts, expires_at) VALUES (?, ?, ?, ?, ?)",
+                                 [(owner, resource, start_ts, end_ts, now + ttl) for resource in allocation])
+            conn.execute("COMMIT")
+            return allocation
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def commit(self, owner, ttl):
+        self._connection().execute("UPDATE holds SET committed = 1, expires_at = ? WHERE owner = ? AND committed = 0",
+                                   (time.time() + ttl, owner))
+
+    def release(self, owner):
+        self._connection().execute("DELETE FROM holds WHERE owner = ? AND committed = 0", (owner,))
+
+    def _overlapping(self, conn, start_ts, end_ts, exclude_owner):
+        return conn.execute("SELECT resource, start_ts, end_ts FROM holds "
+                            "WHERE start_ts < ? AND end_ts > ? AND expires_at > ? AND owner != ?",
+                            (end_ts, start_ts, time.time(), exclude_owner or "")).fetchall()
+
+
+def create_reservation_book(url):
+    if url.startswith("sqlite:///"):
+        path = url[len("sqlite:///"):]
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return SQLiteReservationBook(path)
+    if url == "memory://":
+        return MemoryReservationBook()
+    raise ValueError(f"unsupported reservation store: {url}")
@@ -0,0 +1,314 @@
+import collections
+import datetime
+import json
+import logging
+
+from availability import BusyIndex, best_slots, merge_intervals, parse_event_time
+
+logger = logging.getLogger(__name__)
+
+Service = collections.namedtuple("Service", "name keyword duration resources")
+
+DEFAULT_DURATION = datetime.timedelta(hours=1)
+# Google caps a batch request at 50 calls and a freebusy query at 50
+# calendars.
+BATCH_LIMIT = 50
+FREEBUSY_LIMIT = 50
+# A committed hold outlives the longest a worker's busy index goes without
+# syncing by this many seconds, which covers the sync itself.
+SYNC_MARGIN = 10
+
+# The keyword is what extract_date_time_and_type looks for in a message; the
+# resources say how many members of each resource pool a booking ties up.
+SERVICES = [
+    Service("Classic Manicure", "classic manicure", datetime.timedelta(minutes=45), {"nail_technician": 1}),
+    Service("Deluxe Pedicure", "deluxe pedicure", datetime.timedelta(hours=1), {"nail_technician": 1}),
+    Service("Facial Treatment", "facial treatment", datetime.timedelta(hours=1), {"therapist": 1, "treatment_room": 1}),
+    Service("Haircut and Styling", "haircut and styling", datetime.timedelta(hours=1), {"stylist": 1}),
+    Service("Hair Coloring", "hair coloring", datetime.timedelta(hours=2), {"stylist": 1}),
+    Service("Waxing (Full Body)", "waxing", datetime.timedelta(hours=1), {"therapist": 1, "treatment_room": 1}),
+    Service("Eyelash Extensions", "eyelash extensions", datetime.timedelta(minutes=90), {"lash_technician": 1}),
+    Service("Microdermabrasion", "microdermabrasion", datetime.timedelta(minutes=45), {"therapist": 1, "treatment_room": 1}),
+    Service("Chemical Peel", "chemical peel", datetime.timedelta(minutes=45), {"therapist": 1, "treatment_room": 1}),
+    Service("Massage Therapy (1 hour)", "massage therapy", datetime.timedelta(hours=1), {"therapist": 1, "treatment_room": 1}),
+    Service("Bridal Makeup", "bridal makeup", datetime.timedelta(hours=2), {"makeup_artist": 1}),
+    Service("Hair Spa Treatment", "hair spa treatment", datetime.timedelta(hours=1), {"stylist": 1}),
+]
+
+
+def find_service(text):
+    if not text:
+        return None
+    text = text.lower()
+    for service in SERVICES:
+        if service.keyword in text:
+            return service
+    return None
+
+
+def service_duration(text):
+    service = find_service(text)
+    return service.duration if service else DEFAULT_DURATION
+
+
+def load_resource_pools(path, default_calendar_id):
+    if not path:
+        return {"staff": [default_calendar_id]}
+    with open(path) as f:
+        return json.load(f)
+
+
+def pool_busy_intervals(member_busy, needed, horizon_start, horizon_end):
+    # Sweep over the busy blocks of every member: the pool is busy wherever
+    # fewer than `needed` members are free.
+    if needed > len(member_busy):
+        return [(horizon_start, horizon_end)]
+    limit = len(member_busy) - needed
+    edges = []
+    for intervals in member_busy:
+        for start, end in merge_intervals(intervals):
+            edges.append((start, 1))
+            edges.append((end, -1))
+    edges.sort(key=lambda edge: (edge[0], edge[1]))
+    busy = []
+    count = 0
+    busy_since = None
+    for moment, delta in edges:
+        count += delta
+        if count > limit and busy_since is None:
+            busy_since = moment
+        elif count <= limit and busy_since is not None:
+            busy.append((busy_since, moment))
+            busy_since = None
+    return busy
+
+
+# Books services against pools of interchangeable resources (stylists,
+# treatment rooms, ...), each member backed by its own Google Calendar, so
+# several clients can be served at the same time.
+class ResourceScheduler:
+    def __init__(self, pools, service_factory, tz, reservations, max_staleness=30, default_pool="staff",
+                 hold_ttl=600):
+        self.pools = pools
+        self.service_factory = service_factory
+        self.tz = tz
+        self.reservations = reservations
+        self.hold_ttl = hold_ttl
+        self.commit_ttl = max_staleness + SYNC_MARGIN
+        self.default_pool = default_pool if default_pool in pools else next(iter(pools))
+        self.indexes = {
+            calendar_id: BusyIndex(service_factory, calendar_id, tz, max_staleness=max_staleness)
+            for members in pools.values() for calendar_id in members
+        }
+
+    def requirements(self, service):
+        # Resource types without configured calendars are not tracked; a
+        # service left with no tracked resource needs one default pool member.
+        needs = {}
+        if service is not None:
+            needs = {pool: count for pool, count in service.resources.items() if pool in self.pools}
+        return needs or {self.default_pool: 1}
+
+    def allocate(self, service, start_time, end_time, owner=None):
+        self.refresh(service)
+        return self._allocate(service, start_time, end_time, self.reservations.taken(start_time, end_time, owner))
+
+    def _allocate(self, service, start_time, end_time, taken, is_free=None):
+        # Runs under the reservation lock, so it only reads the busy indexes;
+        # callers refresh them beforehand.
+        is_free = is_free or (lambda calendar_id: self.indexes[calendar_id].is_free(start_time, end_time, sync=False))
+        allocation = []
+        for pool, count in self.requirements(service).items():
+            free = [calendar_id for calendar_id in self.pools[pool] if calendar_id not in taken and is_free(calendar_id)]
+            if len(free) < count:
+                return None
+            allocation.extend(free[:count])
+        return allocation
+
+    def hold(self, service, start_time, end_time, owner):
+        # Replaces any slot the owner held before. Stale calendars are synced
+        # first: reserve() holds a lock every worker waits on, which must
+        # never be held across a Calendar request.
+        self.refresh(service)
+        return self.reservations.reserve(owner, start_time, end_time,
+                                         lambda taken: self._allocate(service, start_time, end_time, taken),
+                                         self.hold_ttl)
+
+    def release(self, owner):
+        self.reservations.release(owner)
+
+    def book(self, service, start_time, end_time, owner, event):
+        # Pull any changes made outside the bot, then (re)take the hold so the
+        # inserts below cannot race another conversation for the same slot.
+        self.sync(service)
+        allocation = self.hold(service, start_time, end_time, owner)
+        if allocation is None:
+            return None
+        from googleapiclient.errors import HttpError
+
+        calendar = self.service_factory()
+        created_events = []
+        try:
+            # One event per allocated resource keeps each stylist's or room's
+            # own calendar accurate.
+            for calendar_id in allocation:
+                created = calendar.events().insert(calendarId=calendar_id, body=event).execute()
+                self.add_event(calendar_id, created)
+                created_events.append((calendar_id, created))
+        except HttpError as e:
+            # All or nothing, as in book_many: an event left behind would keep
+            # its resource busy for a booking that never happened.
+            logger.warning("booking on %s failed: %s", calendar_id, e)
+            self._delete_events(calendar, created_events)
+            self.reservations.release(owner)
+            return None
+        except Exception:
+            self._delete_events(calendar, created_events)
+            self.reservations.release(owner)
+            raise
+        self.reservations.commit(owner, self.commit_ttl)
+        return [created for _, created in created_events]
+
+    def _delete_events(self, calendar, events):
+        for calendar_id, event in events:
+            try:
+                calendar.events().delete(calendarId=calendar_id, eventId=event["id"]).execute()
+            except Exception as e:
+                logger.warning("could not remove event %s on %s: %s", event["id"], calendar_id, e)
+                continue
+            self.add_event(calendar_id, dict(event, status="cancelled"))
+
+    def book_many(self, bookings, owner):
+        # Staff-side bulk booking of (service, start, end, event) tuples: one
+        # freebusy query covers every calendar involved, each booking is held
+        # (as owner:index) against that snapshot and the holds of live
+        # conversations, and the events go out in batch requests. Returns an
+        # (events, error) pair per booking; error is None once booked.
+        if not bookings:
+            return []
+        calendar = self.service_factory()
+        calendar_ids = sorted({calendar_id for service, _, _, _ in bookings
+                               for pool in self.requirements(service) for calendar_id in self.pools[pool]})
+        busy = self.freebusy(calendar, calendar_ids, min(booking[1] for booking in bookings),
+                             max(booking[2] for booking in bookings))
+        results = [(None, "unavailable")] * len(bookings)
+        allocations = {}
+        for i, (service, start_time, end_time, _) in enumerate(bookings):
+            allocation = self.reservations.reserve(f"{owner}:{i}", start_time, end_time,
+                                                   self._snapshot_allocator(busy, service, start_time, end_time),
+                                                   self.hold_ttl)
+            if allocation is not None:
+                allocations[i] = allocation
+                for calendar_id in allocation:
+                    busy[calendar_id].append((start_time, end_time))
+
+        inserts = [(i, calendar_id, calendar.events().insert(calendarId=calendar_id, body=bookings[i][3]))
+                   for i, allocation in allocations.items() for calendar_id in allocation]
+        created = collections.defaultdict(dict)
+        failures = {}
+        for i, calendar_id, response, error in self._execute_batches(calendar, inserts):
+            if error is None:
+                created[i][calendar_id] = response
+            else:
+                failures.setdefault(i, error)
+
+        # A booking needing several resources is all or nothing: events that
+        # did get created for a failed one are deleted again.
+        cleanup = [(i, calendar_id, calendar.events().delete(calendarId=calendar_id, eventId=event["id"]))
+                   for i in failures for calendar_id, event in created[i].items()]
+        for i, calendar_id, _, error in self._execute_batches(calendar, cleanup):
+            if error is not None:
+                logger.warning("could not remove event %s on %s: %s", created[i][calendar_id]["id"], calendar_id, error)
+        for i, allocation in allocations.items():
+            if i in failures:
+                self.reservations.release(f"{owner}:{i}")
+                results[i] = (None, str(failures[i]))
+                continue
+            events = [created[i][calendar_id] for calendar_id in allocation]
+            for calendar_id, event in zip(allocation, events):
+                self.add_event(calendar_id, event)
+            self.reservations.commit(f"{owner}:{i}", self.commit_ttl)
+            results[i] = (events, None)
+        return results
+
+    def _snapshot_allocator(self, busy, service, start_time, end_time):
+        def is_free(calendar_id):
+            blocks = busy[calendar_id]
+            return blocks is not None and not any(start < end_time and end > start_time for start, end in blocks)
+
+        return lambda taken: self._allocate(service, start_time, end_time, taken, is_free)
+
+    def freebusy(self, calendar, calendar_ids, start_time, end_time):
+        # Busy blocks per calendar; None for a calendar Google could not
+        # report on, which is then never booked.
+        busy = {}
+        for offset in range(0, len(calendar_ids), FREEBUSY_LIMIT):
+            chunk = calendar_ids[offset:offset + FREEBUSY_LIMIT]
+            result = calendar.freebusy().query(body={
+                "timeMin": start_time.isoformat(),
+                "timeMax": end_time.isoformat(),
+                "items": [{"id": calendar_id} for calendar_id in chunk],
+            }).execute()
+            for calendar_id in chunk:
+                info = result.get("calendars", {}).get(calendar_id, {})
+                if info.get("errors"):
+                    logger.warning("freebusy failed for %s: %s", calendar_id, info["errors"])
+                    busy[calendar_id] = None
+                else:
+                    busy[calendar_id] = [(parse_event_time({"dateTime": block["start"]}, self.tz),
+                                          parse_event_time({"dateTime": block["end"]}, self.tz))
+                                         for block in info.get("busy", [])]
+        return busy
+
+    def _execute_batches(self, calendar, requests):
+        # Yields (index, calendar_id, response, error) for every request;
+        # a batch that fails as a whole fails each request in it.
+        for offset in range(0, len(requests), BATCH_LIMIT):
+            chunk = requests[offset:offset + BATCH_LIMIT]
+            outcomes = {}
+            batch = calendar.new_batch_http_request(
+                callback=lambda request_id, response, error: outcomes.__setitem__(int(request_id), (response, error)))
+            for n, (_, _, request) in enumerate(chunk):
+                batch.add(request, request_id=str(n))
+            try:
+                batch.execute()
+            except Exception as e:
+                logger.warning("calendar batch request failed: %s", e)
+                outcomes = {n: (None, e) for n in range(len(chunk))}
+            for n, (i, calendar_id, _) in enumerate(chunk):
+                response, error = outcomes.get(n, (None, "no response"))
+                yield i, calendar_id, response, error
+
+    def busy_intervals(self, service, start_time, end_time, owner=None):
+        held = collections.defaultdict(list)
+        for calendar_id, start_ts, end_ts in self.reservations.blocks(start_time, end_time, owner):
+            held[calendar_id].append((datetime.datetime.fromtimestamp(start_ts, self.tz),
+                                      datetime.datetime.fromtimestamp(end_ts, self.tz)))
+        busy = []
+        for pool, count in self.requirements(service).items():
+            member_busy = [self.indexes[calendar_id].busy_intervals(start_time, end_time) + held[calendar_id]
+                           for calendar_id in self.pools[pool]]
+            busy.extend(pool_busy_intervals(member_busy, count, start_time, end_time))
+        return busy
+
+    def find_slots(self, service, requested, duration, horizon_start, horizon_end, count=3, owner=None):
+        busy = self.busy_intervals(service, horizon_start, horizon_end, owner)
+        candidates = best_slots(busy, requested, duration, horizon_start, horizon_end, self.tz, count=count * 4)
+        # The pool-level busy blocks ignore which member is free when, so a
+        # candidate is only offered once a concrete allocation exists.
+        slots = [slot for slot in candidates if self.allocate(service, *slot, owner=owner) is not None]
+        return slots[:count]
+
+    def sync(self, service=None):
+        for pool in self.requirements(service):
+            for calendar_id in self.pools[pool]:
+                self.indexes[calendar_id].sync()
+
+    def refresh(self, service=None):
+        # Like sync, but only for calendars older than max_staleness.
+        for pool in self.requirements(service):
+            for calendar_id in self.pools[pool]:
+                self.indexes[calendar_id].ensure_fresh()
+
+    def add_event(self, calendar_id, event):
+        self.indexes[calendar_id].add_event(event)
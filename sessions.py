@@ -0,0 +1,118 @@
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+
+# Conversation state lives on the server, keyed by a session id, so /chat only
+# carries the new message. The memory store suits a single worker process;
+# the SQLite store is shared by every gunicorn worker on the host and keeps
+# the state msgpack-encoded.
+class MemorySessionStore:
+    def __init__(self, ttl=3600, max_sessions=10000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = collections.OrderedDict()
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            expires_at, state = entry
+            if expires_at <= time.monotonic():
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return state
+
+    def set(self, session_id, state):
+        with self._lock:
+            self._sessions[session_id] = (time.monotonic() + self.ttl, state)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionStore:
+    def __init__(self, path, ttl=3600, prune_every=500):
+        self.path = path
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._writes = 0
+        # srsly (installed with spaCy) bundles msgpack; it is only imported
+        # when this store is used.
+        from srsly import msgpack
+
+        self._msgpack = msgpack
+        # The schema is set up on a throwaway connection: a store created in a
+        # preloading gunicorn master must not hand an open SQLite connection
+        # down to the workers it forks.
+        conn = self._connect()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions "
+                         "(id TEXT PRIMARY KEY, state BLOB NOT NULL, expires_at REAL NOT NULL)")
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _packer(self):
+        # srsly's pack/unpack helpers look up its extension registries (and so
+        # the installed packages' entry points) on every call; a Packer built
+        # once per thread, and unpacking with an explicit object_pairs_hook,
+        # skip that.
+        packer = getattr(self._local, "packer", None)
+        if packer is None:
+            packer = self._local.packer = self._msgpack.Packer(use_bin_type=True)
+        return packer
+
+    def get(self, session_id):
+        row = self._connection().execute(
+            "SELECT state FROM sessions WHERE id = ? AND expires_at > ?", (session_id, time.time())).fetchone()
+        if row is None:
+            return None
+        try:
+            return self._msgpack.unpackb(row[0], raw=False, object_pairs_hook=dict)
+        except (TypeError, ValueError):
+            # Written as JSON by an earlier version.
+            return None
+
+    def set(self, session_id, state):
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO sessions (id, state, expires_at) VALUES (?, ?, ?)",
+                         (session_id, self._packer().pack(state), time.time() + self.ttl))
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, session_id):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+
+def create_session_store(url, ttl=3600):
+    if url.startswith("sqlite:///"):
+        path = url[len("sqlite:///"):]
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return SQLiteSessionStore(path, ttl=ttl)
+    if url == "memory://":
+        return MemorySessionStore(ttl=ttl)
+    raise ValueError(f"unsupported session store: {url}")
@@ -0,0 +1,182 @@
+import datetime
+import functools
+import re
+
+WEEKDAYS = {
+    "monday": 0, "mon": 0, "tuesday": 1, "tue": 1, "tues": 1, "wednesday": 2, "wed": 2,
+    "thursday": 3, "thu": 3, "thur": 3, "thurs": 3, "friday": 4, "fri": 4, "saturday": 5, "sat": 5,
+    "sunday": 6, "sun": 6,
+}
+MONTHS = {
+    "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3, "april": 4, "apr": 4, "may": 5,
+    "june": 6, "jun": 6, "july": 7, "jul": 7, "august": 8, "aug": 8, "september": 9, "sept": 9, "sep": 9,
+    "october": 10, "oct": 10, "november": 11, "nov": 11, "december": 12, "dec": 12,
+}
+RELATIVE_DAYS = {"today": 0, "tomorrow": 1, "tomorow": 1, "tmrw": 1, "tmr": 1}
+# A date without a time means the first slot of that day.
+OPENING_TIME = datetime.time(9)
+COUNTS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7}
+
+_WEEKDAY = "|".join(sorted(WEEKDAYS, key=len, reverse=True))
+_MONTH = "|".join(sorted(MONTHS, key=len, reverse=True))
+_ORDINAL = r"(\d{1,2})(?:st|nd|rd|th)?"
+
+# Each rule is tried in order and the first match of its kind wins; the date
+# rules run before the time rules so the day of "August 12 at 3" is not read
+# as an hour.
+DATE_RULES = [
+    ("iso", re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")),
+    ("day_month", re.compile(rf"\b(?:the\s+)?{_ORDINAL}(?:\s+of)?\s+({_MONTH})\b(?:\s+(\d{{4}}))?")),
+    ("month_day", re.compile(rf"\b({_MONTH})\s+(?:the\s+)?{_ORDINAL}\b(?:\s+(\d{{4}}))?")),
+    ("after_tomorrow", re.compile(r"\b(?:the\s+)?day after (?:tomorrow|tomorow|tmrw)\b")),
+    ("relative", re.compile(r"\b(" + "|".join(RELATIVE_DAYS) + r")\b")),
+    ("in_days", re.compile(r"\bin\s+(\d+|" + "|".join(COUNTS) + r")\s+(days?|weeks?)\b")),
+    ("weekday", re.compile(rf"\b(?:(next|this|coming)\s+)?({_WEEKDAY})\b")),
+    ("ordinal", re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)\b")),
+]
+TIME_RULES = [
+    ("meridiem", re.compile(r"(?<![\d:.])(\d{1,2})(?:[:.](\d{2}))?\s*(am|pm)\b")),
+    ("clock", re.compile(r"(?<![\d:.])(\d{1,2}):(\d{2})\b")),
+    ("oclock", re.compile(r"\b(\d{1,2})\s*o'?clock\b")),
+    ("at_hour", re.compile(r"\bat\s+(\d{1,2})\b(?![:./-]?\d)")),
+    ("noon", re.compile(r"\b(noon|midday)\b")),
+]
+# Whatever is left once the rules have matched must not look like another
+# date or time, or the message is too unusual for the fast path. Only full
+# names count here, and not "may", which is mostly "May I ...". A part of the
+# day ("Friday afternoon", "tonight") is a time the rules cannot pin down, and
+# a week, month or year, or a "next" not taken by "next Monday", moves the
+# date in ways they do not read ("next week on Tuesday", "next month on the
+# 5th", "this weekend").
+LEFTOVER = re.compile(r"\d|\b(?:" + "|".join(name for name, _ in sorted(MONTHS.items()) if len(name) > 3)
+                      + "|" + "|".join(name for name in WEEKDAYS if name.endswith("day"))
+                      + r"|midnight|morning|afternoon|evening|tonight|night"
+                      + r"|weeks?|weekends?|months?|years?|next)\b")
+
+
+def normalize(text):
+    text = text.lower().replace("a.m.", "am").replace("p.m.", "pm")
+    text = re.sub(r"[,!?;]|\.(?!\d)", " ", text)
+    return " ".join(text.split())
+
+
+def _business_hour(hour):
+    # Without am/pm, 1 to 8 can only mean the afternoon at a salon that
+    # opens at 9.
+    return hour + 12 if 1 <= hour <= 8 else hour
+
+
+def _next_date(today, year, month, day):
+    try:
+        date = datetime.date(year or today.year, month, day)
+    except ValueError:
+        return None
+    if year is None and date < today:
+        try:
+            date = date.replace(year=today.year + 1)
+        except ValueError:
+            return None
+    return date
+
+
+def _resolve_date(kind, match, today):
+    if kind == "iso":
+        try:
+            return datetime.date(*map(int, match.groups()))
+        except ValueError:
+            return None
+    if kind in ("day_month", "month_day"):
+        day, month, year = match.groups() if kind == "day_month" else (match.group(2), match.group(1), match.group(3))
+        return _next_date(today, int(year) if year else None, MONTHS[month], int(day))
+    if kind == "after_tomorrow":
+        return today + datetime.timedelta(days=2)
+    if kind == "relative":
+        return today + datetime.timedelta(days=RELATIVE_DAYS[match.group(1)])
+    if kind == "in_days":
+        count = COUNTS.get(match.group(1)) or int(match.group(1))
+        return today + datetime.timedelta(days=count * (7 if match.group(2).startswith("week") else 1))
+    if kind == "weekday":
+        ahead = (WEEKDAYS[match.group(2)] - today.weekday()) % 7
+        if match.group(1) == "next" and ahead == 0:
+            ahead = 7
+        return today + datetime.timedelta(days=ahead)
+    day = int(match.group(1))
+    date = _next_date(today, today.year, today.month, day) if 1 <= day <= 31 else None
+    if date is not None and date < today:
+        month = today.month % 12 + 1
+        date = _next_date(today, today.year + (month == 1), month, day)
+    return date
+
+
+def _resolve_time(kind, match):
+    if kind == "noon":
+        return datetime.time(12)
+    hour = int(match.group(1))
+    minute = int(match.group(2)) if kind in ("meridiem", "clock") and match.group(2) else 0
+    if kind == "meridiem":
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if match.group(3) == "pm" else 0)
+    elif kind != "clock" or hour < 13:
+        hour = _business_hour(hour)
+    if hour > 23 or minute > 59:
+        return None
+    return datetime.time(hour, minute)
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse(text, today):
+    spans = []
+    date = time = None
+    for kind, pattern in DATE_RULES:
+        match = pattern.search(text)
+        if match:
+            date = _resolve_date(kind, match, today)
+            if date is None:
+                return None, None
+            spans.append(match.span())
+            break
+    for kind, pattern in TIME_RULES:
+        match = _search_outside(pattern, text, spans)
+        if match:
+            time = _resolve_time(kind, match)
+            if time is None:
+                return None, None
+            spans.append(match.span())
+            break
+    if not spans:
+        return None, None
+    leftover = text
+    for start, end in sorted(spans, reverse=True):
+        leftover = leftover[:start] + " " + leftover[end:]
+    if LEFTOVER.search(leftover):
+        return None, None
+    return date, time
+
+
+def _search_outside(pattern, text, spans):
+    for match in pattern.finditer(text):
+        if not any(match.start() < end and match.end() > start for start, end in spans):
+            return match
+    return None
+
+
+# Rule-based parser for the ways people usually write when they want to come
+# in ("next Monday at 2 PM", "tomorrow 15:30", "the 12th at 3pm"). It returns
+# None for anything it is not sure about so the caller can fall back to a
+# more lenient parser. Results are cached per normalized text and day.
+def parse_when(text, now):
+    if not text:
+        return None
+    date, time = _parse(normalize(text), now.date())
+    if date is None and time is None:
+        return None
+    if date is None:
+        date = now.date() if time > now.time() else now.date() + datetime.timedelta(days=1)
+    time = time or OPENING_TIME
+    return now.replace(year=date.year, month=date.month, day=date.day, hour=time.hour, minute=time.minute,
+                       second=0, microsecond=0)
+
+
+def cache_info():
+    return _parse.cache_info()
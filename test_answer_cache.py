@@ -0,0 +1,62 @@
+import unittest
+
+from answer_cache import AnswerCache, about_asker
+
+
+class FirstPersonQuestionsTest(unittest.TestCase):
+    def test_questions_about_the_asker_are_not_cached(self):
+        cache = AnswerCache()
+        for question in ("When is my booking?", "What is my phone number on file?",
+                         "Can you remind me what I booked?", "I'm not sure what time I'm coming, can you check?"):
+            self.assertTrue(about_asker(question), question)
+            cache.put(question, "Your facial is on Monday at 2 PM, Jane.")
+            self.assertIsNone(cache.get(question), question)
+
+    def test_general_questions_are_cached(self):
+        cache = AnswerCache()
+        cache.put("What are your opening hours?", "9 AM to 6 PM.")
+        self.assertEqual(cache.get("what are your opening hours"), "9 AM to 6 PM.")
+
+
+class SharedAnswersTest(unittest.TestCase):
+    def setUp(self):
+        import app
+        from fake_assistant import FakeAssistantClient
+        from test_app import create_test_app
+
+        self.app = app
+        self.assistant = FakeAssistantClient(latency=0)
+        create_test_app(self, assistant=self.assistant)
+
+    def ask(self, session, message):
+        before = self.assistant.calls["runs.create"]
+        self.app.handle_message(message, session)
+        return self.assistant.calls["runs.create"] > before
+
+    def test_answers_seen_by_a_client_thread_are_not_shared(self):
+        client = self.app.Session()
+        self.assertTrue(self.ask(client, "What is my phone number on file?"))
+        self.assertTrue(client.personal)
+        self.assertTrue(self.ask(client, "What are your prices?"))
+        # Written from a thread holding the first client's details, so the
+        # next client gets a fresh run rather than that answer.
+        self.assertTrue(self.ask(self.app.Session(), "What are your prices?"))
+        self.assertFalse(self.ask(self.app.Session(), "What are your prices?"))
+
+    def test_greetings_and_follow_ups_do_not_stop_sharing(self):
+        client = self.app.Session()
+        for message in ("Hi", "and for pedicures?", "What are your opening hours?"):
+            self.assertTrue(self.ask(client, message))
+        self.assertFalse(client.personal)
+        self.assertFalse(self.ask(self.app.Session(), "What are your opening hours?"))
+
+    def test_booking_turns_mark_the_session_personal(self):
+        client = self.app.Session()
+        client.state = self.app.ASK_NAME
+        self.app.handle_message("Jane Doe", client)
+        self.assertTrue(client.personal)
+        self.assertEqual(self.app.Session.load(client.dump(), self.app.UAE_TZ).personal, True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import datetime
+import unittest
+
+import app
+from fake_assistant import FakeAssistantClient
+from fake_calendar import FakeCalendarService
+
+# Module globals that use_backends replaces.
+BACKEND_STATE = ("openai_client", "calendar_service", "answer_cache", "conversation_state", "reservations",
+                 "scheduler")
+
+
+def create_test_app(test, assistant=None, calendar=None):
+    # An app on the given backends; the process-wide ones are put back once
+    # the test is over.
+    for name in BACKEND_STATE:
+        test.addCleanup(setattr, app, name, getattr(app, name))
+    return app.create_app(assistant=assistant, calendar=calendar)
+
+
+class BackendSwapTest(unittest.TestCase):
+    def test_nothing_read_from_the_old_backends_carries_over(self):
+        first = FakeCalendarService()
+        start = app.UAE_TZ.localize(datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1),
+                                                              datetime.time(14)))
+        end = start + datetime.timedelta(hours=1)
+        first.add_event(start, end, calendar_id=app.CALENDAR_ID)
+        create_test_app(self, assistant=FakeAssistantClient(latency=0), calendar=first)
+        self.assertEqual(app.scheduler.allocate(None, start, end), None)
+        app.answer_cache.put("What are your opening hours?", "9 AM to 6 PM.")
+        app.conversation_state.set("abc", app.Session().dump())
+
+        create_test_app(self, calendar=FakeCalendarService())
+        self.assertEqual(app.scheduler.allocate(None, start, end), [app.CALENDAR_ID])
+        self.assertIsNone(app.answer_cache.get("What are your opening hours?"))
+        self.assertIsNone(app.conversation_state.get("abc"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import datetime
+import random
+import unittest
+
+import pytz
+
+from availability import best_slots, free_windows
+
+UAE_TZ = pytz.timezone("Asia/Dubai")
+OPENING, CLOSING = datetime.time(9), datetime.time(18)
+HOUR = datetime.timedelta(hours=1)
+STEP = datetime.timedelta(minutes=15)
+
+
+def at(day, hour, minute=0):
+    return UAE_TZ.localize(datetime.datetime.combine(day, datetime.time(hour, minute)))
+
+
+# Every aligned start in business hours, checked one by one against the busy
+# blocks: what best_slots must agree with.
+def every_free_slot(busy, duration, horizon_start, horizon_end):
+    slots = []
+    day = horizon_start.date()
+    while day <= horizon_end.date():
+        start = at(day, 9)
+        while start + duration <= min(at(day, 18), horizon_end):
+            end = start + duration
+            if start >= horizon_start and not any(s < end and e > start for s, e in busy):
+                slots.append((start, end))
+            start += STEP
+        day += datetime.timedelta(days=1)
+    return slots
+
+
+class FreeWindowsTest(unittest.TestCase):
+    def test_busy_blocks_are_merged_and_cut_to_business_hours(self):
+        day = datetime.date(2024, 8, 5)
+        busy = [(at(day, 10), at(day, 11)), (at(day, 10, 30), at(day, 12)), (at(day, 17), at(day, 20))]
+        windows = free_windows(busy, at(day, 0), at(day + datetime.timedelta(days=1), 12), UAE_TZ, OPENING, CLOSING)
+        self.assertEqual([(datetime.datetime.fromtimestamp(s, UAE_TZ), datetime.datetime.fromtimestamp(e, UAE_TZ))
+                          for s, e, _ in windows],
+                         [(at(day, 9), at(day, 10)), (at(day, 12), at(day, 17)),
+                          (at(day + datetime.timedelta(days=1), 9), at(day + datetime.timedelta(days=1), 12))])
+
+    def test_the_horizon_start_cuts_into_the_day(self):
+        day = datetime.date(2024, 8, 5)
+        windows = free_windows([], at(day, 13, 20), at(day, 23), UAE_TZ, OPENING, CLOSING)
+        self.assertEqual([(s, e) for s, e, _ in windows], [(at(day, 13, 20).timestamp(), at(day, 18).timestamp())])
+        self.assertEqual(windows[0][2], at(day, 9).timestamp())
+
+
+class BestSlotsTest(unittest.TestCase):
+    def test_a_free_requested_slot_comes_first(self):
+        day = datetime.date(2024, 8, 5)
+        slots = best_slots([], at(day, 14), HOUR, at(day, 0), at(day, 23), UAE_TZ)
+        self.assertEqual(slots, [(at(day, 14), at(day, 15)), (at(day, 13, 45), at(day, 14, 45)),
+                                 (at(day, 14, 15), at(day, 15, 15))])
+
+    def test_a_full_day_moves_to_the_next_opening(self):
+        day = datetime.date(2024, 8, 5)
+        busy = [(at(day, 9), at(day, 18))]
+        slots = best_slots(busy, at(day, 16), HOUR, at(day, 0), at(day, 0) + datetime.timedelta(days=3), UAE_TZ,
+                           count=1)
+        self.assertEqual(slots, [(at(day + datetime.timedelta(days=1), 9), at(day + datetime.timedelta(days=1), 10))])
+
+    def test_matches_checking_every_slot(self):
+        rng = random.Random(8)
+        day = datetime.date(2024, 8, 5)
+        horizon_start, horizon_end = at(day, 0), at(day, 0) + datetime.timedelta(days=4)
+        for _ in range(300):
+            busy = []
+            for _ in range(rng.randint(0, 12)):
+                start = at(day, 8) + datetime.timedelta(minutes=5 * rng.randint(0, 12 * 24 * 4))
+                busy.append((start, start + datetime.timedelta(minutes=5 * rng.randint(1, 36))))
+            duration = datetime.timedelta(minutes=rng.choice([45, 60, 90, 120]))
+            requested = at(day, 9) + datetime.timedelta(minutes=5 * rng.randint(0, 12 * 24 * 3))
+            expected = sorted(every_free_slot(busy, duration, horizon_start, horizon_end),
+                              key=lambda slot: (abs(slot[0] - requested), slot[0]))[:3]
+            self.assertEqual(best_slots(busy, requested, duration, horizon_start, horizon_end, UAE_TZ), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
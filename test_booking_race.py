@@ -0,0 +1,69 @@
+import collections
+import concurrent.futures
+import tempfile
+import threading
+import types
+import unittest
+
+from fake_calendar import FakeCalendarServer
+from loadtest import check_bookings, post, start_server
+
+CLIENTS = 12
+REQUEST = "I want to book a haircut and styling tomorrow at 2pm"
+
+
+# Many clients ask for the same slot through /chat on two gunicorn workers
+# sharing SQLite stores: each is offered a slot (held for them) or the
+# closest free one, gives their details, and then all confirm at once.
+class BookingRaceTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.calendar = FakeCalendarServer(latency=0.01)
+        self.calendar.start()
+        options = types.SimpleNamespace(workers=2, worker_class="gevent", threads=8, assistant_latency=0.0)
+        self.server, self.url = start_server(options, self.tmpdir.name, self.calendar.root_url)
+
+    def tearDown(self):
+        self.server.terminate()
+        self.server.wait()
+        self.calendar.stop()
+        self.tmpdir.cleanup()
+
+    def chat(self, message, session_id=None):
+        body = post(self.url + "/chat", {"message": message, "session_id": session_id}, 30)
+        return body["reply"].lower(), body["session_id"]
+
+    def test_parallel_confirmations_never_double_book(self):
+        barrier = threading.Barrier(CLIENTS)
+
+        def client(i):
+            barrier.wait()
+            reply, session_id = self.chat(REQUEST)
+            if "would you like to book this slot instead" in reply:
+                reply, session_id = self.chat("Yes", session_id)
+            if "provide your full name" not in reply:
+                barrier.wait()
+                return None, reply
+            self.chat("Guest%04d Race" % i, session_id)
+            reply, _ = self.chat("+9715%08d" % i, session_id)
+            self.assertIn("is this information correct", reply)
+            barrier.wait()
+            reply, _ = self.chat("Yes", session_id)
+            return "booked" if "i've booked your" in reply else "refused", reply
+
+        with concurrent.futures.ThreadPoolExecutor(CLIENTS) as pool:
+            results = list(pool.map(client, range(CLIENTS)))
+
+        outcomes = [outcome for outcome, _ in results]
+        # An offered slot is held for the client, so every confirmation of it
+        # goes through and none is refused.
+        self.assertNotIn("refused", outcomes, [reply for outcome, reply in results if outcome == "refused"])
+        self.assertGreaterEqual(outcomes.count("booked"), 2)
+        conversations = [{"service": "haircut and styling", "name": "Guest%04d Race" % i} for i in range(CLIENTS)]
+        self.assertEqual(check_bookings(self.calendar.service, conversations, outcomes), [])
+        starts = collections.Counter(event["start"]["dateTime"] for event in self.calendar.service._events.values())
+        self.assertLessEqual(max(starts.values()), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+import pytz
+
+from conversation import CONFIRM, FORMAT, IDLE, Session
+from sessions import create_session_store
+
+UAE_TZ = pytz.timezone("Asia/Dubai")
+
+
+def booking_session():
+    session = Session()
+    session.state = CONFIRM
+    session.service = "facial treatment"
+    session.start = UAE_TZ.localize(datetime.datetime(2024, 8, 6, 15))
+    session.end = session.start + datetime.timedelta(hours=1)
+    session.suggested_start = UAE_TZ.localize(datetime.datetime(2024, 8, 6, 16, 15))
+    session.suggested_end = session.suggested_start + datetime.timedelta(hours=1)
+    session.name = "Jane Doe"
+    session.phone = "+971501234567"
+    session.hold_id = "hold-1"
+    session.thread_id = "thread-1"
+    session.messages = [("user", "Book a facial treatment tomorrow at 3pm"), ("assistant", "Sure.")]
+    session.personal = True
+    return session
+
+
+class SessionDumpTest(unittest.TestCase):
+    def assertSameSession(self, loaded, session):
+        for name in Session.__slots__:
+            self.assertEqual(getattr(loaded, name), getattr(session, name), name)
+
+    def test_load_restores_what_dump_wrote(self):
+        session = booking_session()
+        loaded = Session.load(session.dump(), UAE_TZ)
+        self.assertSameSession(loaded, session)
+        self.assertEqual(loaded.start.tzinfo.zone, "Asia/Dubai")
+        self.assertSameSession(Session.load(Session().dump(), UAE_TZ), Session())
+
+    def test_round_trip_through_the_session_stores(self):
+        session = booking_session()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for url in ("memory://", "sqlite:///" + os.path.join(tmpdir, "sessions.db")):
+                store = create_session_store(url)
+                store.set("abc", session.dump())
+                self.assertSameSession(Session.load(store.get("abc"), UAE_TZ), session)
+
+    def test_unknown_layouts_start_over(self):
+        data = booking_session().dump()
+        for stale in (None, [], {"state": CONFIRM}, [FORMAT - 1] + data[1:-1]):
+            loaded = Session.load(stale, UAE_TZ)
+            self.assertEqual((loaded.state, loaded.service, loaded.messages, loaded.personal), (IDLE, None, [], False))
+
+
+if __name__ == "__main__":
+    unittest.main()
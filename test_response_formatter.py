@@ -0,0 +1,59 @@
+import random
+import unittest
+
+from app import ResponseFormatter, format_response
+
+
+# The formatter /chat used before replies were streamed, kept here as the
+# reference ResponseFormatter has to match.
+def whole_reply_format(response):
+    if "*" in response:
+        lines = response.split("\n")
+        formatted_lines = []
+        in_list = False
+        for line in lines:
+            if line.startswith("*"):
+                if not in_list:
+                    formatted_lines.append("<ul>")
+                    in_list = True
+                formatted_lines.append(f"<li>{line[1:].strip()}</li>")
+            else:
+                if in_list:
+                    formatted_lines.append("</ul>")
+                    in_list = False
+                formatted_lines.append(line)
+        if in_list:
+            formatted_lines.append("</ul>")
+        response = "<br>".join(formatted_lines)
+    else:
+        response = response.replace('\n', '<br>')
+    return response
+
+
+def feed_in_chunks(text, rng):
+    formatter = ResponseFormatter()
+    out = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 6)
+        out.append(formatter.feed(text[i:i + size]))
+        i += size
+    return "".join(out) + formatter.close()
+
+
+class ResponseFormatterTest(unittest.TestCase):
+    def test_lists_and_line_breaks(self):
+        self.assertEqual(format_response("We offer:\n* Manicure\n*  Pedicure \nBook now"),
+                         "We offer:<br><ul><br><li>Manicure</li><br><li>Pedicure</li><br></ul><br>Book now")
+        self.assertEqual(format_response("Hello\n\nthere"), "Hello<br><br>there")
+        self.assertEqual(format_response(""), "")
+
+    def test_chunked_output_matches_the_whole_reply_formatter(self):
+        rng = random.Random(11)
+        for _ in range(20000):
+            text = "".join(rng.choice("ab *\n") for _ in range(rng.randint(0, 24)))
+            self.assertEqual(feed_in_chunks(text, rng), whole_reply_format(text), repr(text))
+
+
+if __name__ == "__main__":
+    unittest.main()
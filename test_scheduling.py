@@ -0,0 +1,66 @@
+import datetime
+import threading
+import time
+import unittest
+
+import pytz
+
+from fake_calendar import FakeCalendarService
+from reservations import MemoryReservationBook
+from scheduling import ResourceScheduler, find_service
+
+UAE_TZ = pytz.timezone("Asia/Dubai")
+
+
+class CommittedHoldTest(unittest.TestCase):
+    def setUp(self):
+        self.calendar = FakeCalendarService()
+        self.scheduler = ResourceScheduler({"stylist": ["stylist-1"]}, lambda: self.calendar, UAE_TZ,
+                                           MemoryReservationBook(), max_staleness=0)
+        self.service = find_service("haircut and styling")
+        day = datetime.date.today() + datetime.timedelta(days=1)
+        self.start = UAE_TZ.localize(datetime.datetime.combine(day, datetime.time(14)))
+        self.end = self.start + self.service.duration
+
+    def test_an_appointment_cancelled_in_the_calendar_frees_its_slot(self):
+        self.scheduler.commit_ttl = 0.2
+        events = self.scheduler.book(self.service, self.start, self.end, "alice", {"summary": "Haircut"})
+        self.assertIsNone(self.scheduler.hold(self.service, self.start, self.end, "bob"))
+        # Staff cancel the appointment in Google Calendar.
+        self.calendar.delete_event(events[0]["id"])
+        time.sleep(0.3)
+        self.assertEqual(self.scheduler.hold(self.service, self.start, self.end, "bob"), ["stylist-1"])
+
+    def test_no_calendar_request_is_made_under_the_reservation_lock(self):
+        reservations = self.scheduler.reservations
+        reserve = reservations.reserve
+        calls = []
+
+        def counting_reserve(owner, start_time, end_time, allocate, ttl):
+            before = self.calendar.calls
+            try:
+                return reserve(owner, start_time, end_time, allocate, ttl)
+            finally:
+                calls.append(self.calendar.calls - before)
+
+        reservations.reserve = counting_reserve
+        # With max_staleness=0 every index is stale on every check.
+        self.assertIsNotNone(self.scheduler.hold(self.service, self.start, self.end, "alice"))
+        self.assertIsNotNone(self.scheduler.book(self.service, self.start, self.end, "alice", {"summary": "Haircut"}))
+        self.assertGreater(self.calendar.calls, 0)
+        self.assertEqual(calls, [0, 0])
+
+    def test_a_slow_sync_does_not_hold_up_the_allocator(self):
+        self.scheduler.sync()
+        self.calendar.latency = 1.0
+        syncing = threading.Thread(target=self.scheduler.sync)
+        syncing.start()
+        time.sleep(0.1)
+        began = time.monotonic()
+        self.assertEqual(self.scheduler._allocate(self.service, self.start, self.end, set()), ["stylist-1"])
+        self.assertLess(time.monotonic() - began, 0.5)
+        syncing.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
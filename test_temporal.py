@@ -0,0 +1,18 @@
+import unittest
+
+from benchmarks import DATE_NOW, DATE_PHRASES
+from temporal import parse_when
+
+
+class DatePhrasesTest(unittest.TestCase):
+    # The corpus bench_dates reports on: every phrase the fast path accepts
+    # must come out as expected, and the ones expected to miss must be left
+    # to the fallback parser.
+    def test_the_benchmark_corpus(self):
+        for phrase, expected in DATE_PHRASES:
+            parsed = parse_when(phrase, DATE_NOW)
+            self.assertEqual(parsed and parsed.strftime("%Y-%m-%d %H:%M"), expected, phrase)
+
+
+if __name__ == "__main__":
+    unittest.main()
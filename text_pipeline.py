@@ -0,0 +1,57 @@
+import functools
+import os
+import threading
+
+import tracing
+
+SPACY_MODEL = os.environ.get("SPACY_MODEL", "en_core_web_sm")
+# Only tokenization and NER are used. The NER component of the efficiency
+# pipelines carries its own tok2vec, so the shared one can go with the tagger
+# and parser that listen to it.
+SPACY_EXCLUDE = [
+    name for name in os.environ.get(
+        "SPACY_EXCLUDE", "tok2vec,tagger,parser,attribute_ruler,lemmatizer,senter").split(",")
+    if name
+]
+
+
+def load_pipeline(model=SPACY_MODEL, exclude=SPACY_EXCLUDE):
+    # spaCy itself takes over a second to import, so it is only pulled in
+    # once a pipeline is actually needed.
+    import spacy
+
+    return spacy.load(model, exclude=exclude)
+
+
+# Every extractor asks for the Doc of the current message through parse(), so
+# a message goes through the pipeline once no matter how many look at it. The
+# pipeline is loaded on first use (or by load()), not when the parser is made.
+class MessageParser:
+    def __init__(self, loader=load_pipeline, cache_size=256):
+        self.loader = loader
+        self._nlp = None
+        self._lock = threading.Lock()
+        self._cache = functools.lru_cache(maxsize=cache_size)(self._parse)
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            self.load()
+        return self._nlp
+
+    def load(self):
+        with self._lock:
+            if self._nlp is None:
+                self._nlp = self.loader()
+        return self._nlp
+
+    def _parse(self, text):
+        nlp = self.nlp
+        with tracing.stage("nlp"):
+            return nlp(text)
+
+    def parse(self, text):
+        return self._cache(text)
+
+    def cache_info(self):
+        return self._cache.cache_info()
@@ -0,0 +1,254 @@
+import bisect
+import collections
+import contextlib
+import cProfile
+import functools
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = collections.Counter()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in values]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        lines = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+# Metrics of this worker process, rendered in the Prometheus text format.
+# Collectors are functions returning extra (name, kind, help, labels, value)
+# samples computed at scrape time, for state other modules already keep.
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        described = set()
+        for collector in self._collectors:
+            for name, kind, help, labels, value in collector():
+                if name not in described:
+                    described.add(name)
+                    lines.append(f"# HELP {name} {help}")
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+REQUEST_SECONDS = registry.histogram("reservo_request_seconds", "Time to answer a chat request.", ["route"])
+STAGE_SECONDS = registry.histogram("reservo_stage_seconds", "Time spent in each stage of answering a message.",
+                                   ["stage"])
+EXTERNAL_CALL_SECONDS = registry.histogram("reservo_external_call_seconds",
+                                           "Duration of calls to the Calendar and OpenAI APIs.", ["api"])
+EXTERNAL_CALLS_PER_REQUEST = registry.histogram("reservo_external_calls_per_request",
+                                                "External API calls made while answering one request.",
+                                                ["service"], buckets=COUNT_BUCKETS)
+POLLS_PER_REQUEST = registry.histogram("reservo_assistant_polls_per_request",
+                                       "Times an Assistant run was polled while answering one request.",
+                                       buckets=COUNT_BUCKETS)
+
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+_local = threading.local()
+
+
+class Trace:
+    def __init__(self, route):
+        self.route = route
+        self.calls = collections.Counter()
+        self.polls = 0
+        self.stages = collections.Counter()
+
+
+def current():
+    return getattr(_local, "trace", None)
+
+
+@contextlib.contextmanager
+def attach(trace):
+    # Lets a helper thread account its work to the request that started it.
+    previous = current()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+@contextlib.contextmanager
+def request(route):
+    trace = Trace(route)
+    profiler = _start_profiler()
+    began = time.perf_counter()
+    try:
+        with attach(trace):
+            yield trace
+    finally:
+        elapsed = time.perf_counter() - began
+        REQUEST_SECONDS.observe(elapsed, route)
+        for service in ("calendar", "openai"):
+            EXTERNAL_CALLS_PER_REQUEST.observe(trace.calls[service], service)
+        POLLS_PER_REQUEST.observe(trace.polls)
+        if profiler is not None:
+            _save_profile(profiler, route)
+        logger.debug("%s took %.1f ms: %s, calls %s, polls %d", route, elapsed * 1000,
+                     dict(trace.stages), dict(trace.calls), trace.polls)
+
+
+@contextlib.contextmanager
+def stage(name):
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - began
+        STAGE_SECONDS.observe(elapsed, name)
+        trace = current()
+        if trace is not None:
+            trace.stages[name] += elapsed
+
+
+def timed(name):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record_call(api, seconds):
+    # api is "<service>.<method>", e.g. "calendar.events.insert".
+    EXTERNAL_CALL_SECONDS.observe(seconds, api)
+    trace = current()
+    if trace is not None:
+        trace.calls[api.split(".", 1)[0]] += 1
+
+
+@contextlib.contextmanager
+def external_call(api):
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_call(api, time.perf_counter() - began)
+
+
+def count_poll():
+    trace = current()
+    if trace is not None:
+        trace.polls += 1
+
+
+def _start_profiler():
+    # Sampling hook: PROFILE_SAMPLE_RATE of the requests run under cProfile
+    # and leave a .prof file in PROFILE_DIR for snakeviz or pstats.
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active on this thread.
+        return None
+    return profiler
+
+
+def _save_profile(profiler, route):
+    profiler.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, "%s-%d-%d.prof" % (route.strip("/").replace("/", "_") or "root",
+                                                         os.getpid(), time.time_ns()))
+    profiler.dump_stats(path)